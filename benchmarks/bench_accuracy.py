@@ -0,0 +1,131 @@
+"""
+Accuracy versus time of the alignment engines on songs rebuilt from the reference
+alignments checked in at the root of the repository.
+
+Usage: python -m benchmarks.bench_accuracy [--noise SIGMA] [--record FILE] [--max-error-s S] [reference.json ...]
+
+For every reference, an emission is synthesized from its line timings (see
+`ReferenceSong`), every engine aligns the song, and the line boundaries it finds are
+compared with the reference. Runs of a banded engine that fell back to the full trellis
+are counted under "fallbacks". With `--record`, results are appended to FILE as JSON lines,
+so runs can be compared over time; with `--max-error-s`, the exit status is 1 if the mean
+boundary error of any engine exceeds it.
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Callable
+import torch
+from lync.aligner import (
+    PathArrays,
+    backtrack,
+    clean_transcript,
+    get_path,
+    get_trellis,
+    merge_emission_lines,
+    merge_repeats_arrays,
+    merge_words_arrays,
+)
+from lync.hierarchical import hierarchical_path
+from lync.profiling import Profiler
+from .synthetic import SAMPLE_RATE, ReferenceSong, boundary_errors
+
+REFERENCES = [
+    "wav2vec2_alignment_anaconda.json",
+    "ctc_seg_alignment_anaconda.json",
+    "ctc_seg_alignment_aatw.json",
+]
+
+Engine = Callable[[ReferenceSong], PathArrays]
+
+
+def engines(band_width: int, coarse_factor: int) -> dict[str, Engine]:
+    def full(song: ReferenceSong) -> PathArrays:
+        trellis = get_trellis(song.emission, song.tokens)
+        return PathArrays.from_points(backtrack(trellis, song.emission, song.tokens))
+
+    return {
+        "full": full,
+        "full_width": lambda song: get_path(song.emission, song.tokens),
+        "banded": lambda song: get_path(song.emission, song.tokens, band_width),
+        "coarse": lambda song: get_path(song.emission, song.tokens, band_width, coarse_factor),
+        "hierarchical": lambda song: hierarchical_path(song.emission, song.tokens, song.transcript, band_width=band_width),
+    }
+
+
+def line_boundaries(song: ReferenceSong, path: PathArrays) -> tuple[list[float], list[float]]:
+    words = merge_words_arrays(merge_repeats_arrays(path), clean_transcript(song.transcript))
+    # converted to seconds the same way as by the aligner
+    lines = merge_emission_lines(words, song.lines, SAMPLE_RATE)
+
+    return [line.start_time_s for line in lines], [line.end_time_s for line in lines]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("references", nargs="*", default=REFERENCES)
+    parser.add_argument("--noise", type=float, default=1.0, help="standard deviation of the logit noise")
+    parser.add_argument("--band-width", type=int, default=256)
+    parser.add_argument("--coarse-factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", metavar="FILE", help="append results to FILE as JSON lines")
+    parser.add_argument("--max-error-s", type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    results = []
+
+    print(f"{'reference':<36} {'engine':<14} {'time (ms)':>10} {'mean err (s)':>13} {'max err (s)':>12} {'<=100ms':>8} {'fallbacks':>9}")
+
+    for reference in args.references:
+        song = ReferenceSong(reference, args.noise, args.seed)
+
+        for name, engine in engines(args.band_width, args.coarse_factor).items():
+            profiler = Profiler()
+
+            try:
+                with profiler.active(trace_memory=False):
+                    start = time.perf_counter()
+                    path = engine(song)
+                    seconds = time.perf_counter() - start
+            except ValueError:
+                print(f"{reference[-36:]:<36} {name:<14} failed to align")
+                failed = True
+                continue
+
+            fallbacks = profiler.counters.get("aligner.band_fallbacks", 0)
+            errors = boundary_errors(*line_boundaries(song, path), song.begins, song.ends)
+            results.append({
+                "reference": reference,
+                "engine": name,
+                "frames": song.num_frames,
+                "tokens": len(song.tokens),
+                "noise": args.noise,
+                "band_width": args.band_width,
+                "coarse_factor": args.coarse_factor,
+                "time_s": seconds,
+                "stages": {stage: summary.wall_s for stage, summary in profiler.stages.items()},
+                "band_fallbacks": fallbacks,
+                **errors,
+            })
+
+            mean, worst, within = errors["mean_error_s"], errors["max_error_s"], errors["within_100ms"]
+            print(f"{reference[-36:]:<36} {name:<14} {seconds * 1000:>10.1f} {mean:>13.4f} {worst:>12.4f} {within:>8.1%} {fallbacks:>9}")
+
+            if args.max_error_s is not None and mean > args.max_error_s:
+                failed = True
+
+    if args.record:
+        recorded_at = time.time()
+        with open(args.record, "a") as fl:
+            for result in results:
+                fl.write(json.dumps({"recorded_at": recorded_at, "torch": torch.__version__, **result}) + "\n")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
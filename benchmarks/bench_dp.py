@@ -0,0 +1,82 @@
+"""
+Benchmark of the dynamic programming and merging stages of the aligner on synthetic
+emissions of varying size.
+
+Usage: python -m benchmarks.bench_dp [--sizes FRAMESxTOKENS ...] [--band-width B] [--trace-memory]
+
+Times come from the `lync.profiling` instrumentation of `lync.aligner`. Peak memory (with
+`--trace-memory`) only covers Python allocations, not tensor storage.
+"""
+
+import argparse
+from lync.aligner import (
+    EMISSION_STRIDE,
+    backtrack,
+    clean_transcript,
+    get_path,
+    get_trellis,
+    merge_lines,
+    merge_lines_arrays,
+    merge_repeats,
+    merge_repeats_arrays,
+    merge_words,
+    merge_words_arrays,
+)
+from lync.profiling import Profiler, stage
+from .synthetic import SAMPLE_RATE, random_transcript, uniform_emission
+
+SIZES = ["1000x100", "4000x500", "12000x2000"]
+# the full trellis is skipped above this many cells
+MAX_FULL_CELLS = 30_000_000
+
+
+def run(num_frames: int, num_tokens: int, band_width: int, coarse_factor: int) -> None:
+    transcript = random_transcript(num_tokens)
+    emission, tokens = uniform_emission(transcript, num_frames)
+    cleaned = clean_transcript(transcript)
+    lines = transcript.split("\n")
+    waveform_len = num_frames * EMISSION_STRIDE
+
+    if num_frames * len(tokens) <= MAX_FULL_CELLS:
+        with stage("full"):
+            path = backtrack(get_trellis(emission, tokens), emission, tokens)
+
+        segments = merge_repeats(path, cleaned)
+        merge_lines(merge_words(segments), lines, waveform_len, SAMPLE_RATE)
+
+    with stage("banded"):
+        path_arrays = get_path(emission, tokens, band_width)
+
+    with stage("coarse"):
+        get_path(emission, tokens, band_width, coarse_factor)
+
+    segment_arrays = merge_repeats_arrays(path_arrays)
+    merge_lines_arrays(merge_words_arrays(segment_arrays, cleaned), lines, waveform_len, SAMPLE_RATE)
+
+    # the list-based merges on the same path, for comparison
+    merge_repeats(path_arrays.to_points(), cleaned)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=SIZES, help="emission sizes as FRAMESxTOKENS")
+    parser.add_argument("--band-width", type=int, default=256)
+    parser.add_argument("--coarse-factor", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        num_frames, num_tokens = (int(n) for n in size.split("x"))
+        profiler = Profiler()
+
+        with profiler.active(trace_memory=args.trace_memory):
+            for _ in range(args.repeat):
+                run(num_frames, num_tokens, args.band_width, args.coarse_factor)
+
+        print(f"\n{num_frames} frames x {num_tokens} tokens, {args.repeat} runs")
+        print(profiler.report())
+
+
+if __name__ == "__main__":
+    main()
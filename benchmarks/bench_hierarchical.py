@@ -0,0 +1,89 @@
+"""
+Agreement with the full alignment and scaling over workers of the hierarchical engine, on
+songs rebuilt from the reference alignments checked in at the root of the repository.
+
+Usage: python -m benchmarks.bench_hierarchical [--workers W ...] [--band-width B] [--coarse-factor C] [reference.json ...]
+
+For every reference, the words found by `hierarchical_path` are compared with those of
+`get_path` on the whole song, and the hierarchical engine is timed serially and on process
+pools of each size in `--workers`. The number of anchors found, and the time spent finding
+them in the coarse alignment at `ANCHOR_FACTOR`, which is not parallel, bound the speedup a
+pool can give.
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from lync.aligner import (
+    PathArrays,
+    _init_worker,
+    clean_transcript,
+    coarse_entries,
+    get_path,
+    merge_repeats_arrays,
+    merge_words_arrays,
+)
+from lync.hierarchical import ANCHOR_FACTOR, blank_frames, find_anchors, hierarchical_path, line_break_tokens
+from lync.profiling import Profiler
+from .bench_accuracy import REFERENCES
+from .synthetic import ReferenceSong
+
+WORKERS = [1, 2, 4, 8]
+
+
+def word_frames(song: ReferenceSong, path: PathArrays) -> list[tuple[int, int]]:
+    words = merge_words_arrays(merge_repeats_arrays(path), clean_transcript(song.transcript))
+    return list(zip(words.start.tolist(), words.end.tolist()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("references", nargs="*", default=REFERENCES)
+    parser.add_argument("--noise", type=float, default=1.0, help="standard deviation of the logit noise")
+    parser.add_argument("--band-width", type=int, default=256)
+    parser.add_argument("--coarse-factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, nargs="+", default=WORKERS)
+    args = parser.parse_args()
+
+    print(f"{'reference':<36} {'workers':>7} {'anchors':>7} {'time (ms)':>10} {'anchors (ms)':>13} {'speedup':>8} {'words differing':>16}")
+
+    for reference in args.references:
+        song = ReferenceSong(reference, args.noise, args.seed)
+
+        start = time.perf_counter()
+        expected = word_frames(song, get_path(song.emission, song.tokens, args.band_width, args.coarse_factor))
+        full_s = time.perf_counter() - start
+
+        entries = coarse_entries(song.emission, song.tokens, ANCHOR_FACTOR)
+        anchors = find_anchors(entries, line_break_tokens(song.transcript), blank_frames(song.emission))
+        print(f"{reference[-36:]:<36} {'full':>7} {'':>7} {full_s * 1000:>10.1f} {'':>13} {'':>8} {'':>16}")
+
+        for workers in [0] + args.workers:
+            executor = ProcessPoolExecutor(workers, initializer=_init_worker) if workers else None
+            profiler = Profiler()
+
+            try:
+                with profiler.active(trace_memory=False):
+                    start = time.perf_counter()
+                    path = hierarchical_path(
+                        song.emission, song.tokens, song.transcript, executor, args.band_width, args.coarse_factor
+                    )
+                    seconds = time.perf_counter() - start
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            found = word_frames(song, path)
+            differing = sum(a != b for a, b in zip(found, expected)) + abs(len(found) - len(expected))
+            anchors_s = sum(profiler.stages[name].wall_s for name in ["hierarchical.coarse_entries", "hierarchical.find_anchors"])
+
+            print(
+                f"{reference[-36:]:<36} {workers or 'serial':>7} {len(anchors):>7} {seconds * 1000:>10.1f} "
+                f"{anchors_s * 1000:>13.1f} {full_s / seconds:>7.2f}x "
+                f"{differing:>7}/{len(expected):<8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of the Genius lyrics page extractor.
+
+Usage: python -m benchmarks.bench_lyrics [--repeat N] page.html [page.html ...]
+
+Each page is a lyrics page saved from genius.com. For every page, reports the time and peak
+memory of extracting the lyrics with the current extractor and with the previous one
+(regex + `literal_eval` + `json.loads` of the whole embedded state).
+"""
+
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from ast import literal_eval
+from typing import Callable
+from lync.external.genius.lyrics import extract_lyrics_data, parse_lyrics_page
+
+
+def legacy_extract_lyrics_data(html_content: str) -> dict:
+    pattern = r"(?<=window\.__PRELOADED_STATE__ = JSON\.parse\()(['\"])(.|\n)+?\1(?=\))"
+    match = re.search(pattern, html_content)
+    json_string = literal_eval(match.group()).replace("\\$", "$")
+
+    return json.loads(json_string)["songPage"]["lyricsData"]
+
+
+def measure(function: Callable[[str], object], html_content: str, repeat: int) -> tuple[float, int]:
+    """
+    Return the best time in seconds out of `repeat` runs of `function` on `html_content`,
+    and the peak memory in bytes allocated by one run.
+    """
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(html_content)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(html_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pages", nargs="+", help="saved lyrics pages")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    candidates = {
+        "extract": extract_lyrics_data,
+        "legacy extract": legacy_extract_lyrics_data,
+        "parse page": parse_lyrics_page,
+    }
+
+    print(f"{'page':<32} {'size':>8} {'function':<16} {'time (ms)':>10} {'peak (KiB)':>11}")
+
+    for page in args.pages:
+        with open(page, "r", encoding="utf-8") as fl:
+            html_content = fl.read()
+
+        if extract_lyrics_data(html_content) != legacy_extract_lyrics_data(html_content):
+            print(f"{page}: extractors disagree")
+
+        for name, function in candidates.items():
+            seconds, peak = measure(function, html_content, args.repeat)
+            print(f"{page[-32:]:<32} {len(html_content) // 1024:>7}K {name:<16} {seconds * 1000:>10.2f} {peak / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of the pipeline around the DP stages, offline: emission inference and alignment
+of whole songs with a stub acoustic model, and the Genius and Soundcloud clients against
+stubbed HTTP.
+
+Usage: python -m benchmarks.bench_pipeline [--songs N] [--duration-s S] [--batch-size B] [--workers W]
+
+Stage times, peak memory and allocations come from the `lync.profiling` instrumentation of
+`lync.aligner` and `lync.external`.
+"""
+
+import argparse
+import os
+import tempfile
+import torch
+import torchaudio
+from lync.aligner import AlignmentJob, Aligner
+from lync.external.genius import Genius
+from lync.external.soundcloud import Soundcloud
+from lync.profiling import Profiler, stage
+from .stubs import (
+    StubAdapter,
+    StubModel,
+    genius_lyrics_page,
+    genius_search_payload,
+    soundcloud_search_payload,
+    static,
+)
+from .synthetic import SAMPLE_RATE, random_transcript
+
+# about 15 characters per second, as in sung lyrics
+TOKENS_PER_SECOND = 15
+
+
+def write_song(directory: str, index: int, duration_s: float) -> AlignmentJob:
+    """
+    Write noise audio and a random transcript for a song, returning its alignment job.
+    """
+
+    generator = torch.Generator().manual_seed(index)
+    waveform = torch.randn(1, int(duration_s * SAMPLE_RATE), generator=generator) * 0.1
+
+    vocal_path = os.path.join(directory, f"{index}.wav")
+    lyrics_path = os.path.join(directory, f"{index}.txt")
+    torchaudio.save(vocal_path, waveform, SAMPLE_RATE)
+
+    with open(lyrics_path, "w") as fl:
+        fl.write(random_transcript(int(duration_s * TOKENS_PER_SECOND), seed=index))
+
+    return AlignmentJob(vocal_path, lyrics_path, os.path.join(directory, f"{index}.json"))
+
+
+def bench_aligner(jobs: list[AlignmentJob], batch_size: int, workers: int, band_width: int) -> None:
+    aligner = Aligner(batch_size=batch_size, band_width=band_width)
+    # the stub stands in for the bundle's model, which would be downloaded on first use
+    aligner._model = StubModel(len(aligner.labels))
+
+    with stage("align"):
+        for job in jobs:
+            aligner.align(job.vocal_path, job.lyrics_path, job.outfile_path)
+
+    with Aligner(batch_size=batch_size, band_width=band_width, workers=workers) as aligner:
+        aligner._model = StubModel(len(aligner.labels))
+
+        with stage("align_many"):
+            aligner.align_many(jobs)
+
+
+def bench_clients(songs: int, segments: int, segment_bytes: int) -> None:
+    transcript = random_transcript(2000)
+
+    genius = Genius(0)
+    genius._session.mount("https://", StubAdapter({
+        "/api/search/multi": static(genius_search_payload("Stub Song", "https://genius.com/stub-lyrics", "https://images.genius.com/stub.jpg")),
+        "/stub-lyrics": static(genius_lyrics_page(transcript), "text/html; charset=utf-8"),
+    }))
+
+    playlist = "\n".join(f"https://cf-hls-media.sndcdn.com/media/{i}.mp3" for i in range(segments))
+    soundcloud = Soundcloud(client_id_cache=None)
+    soundcloud._client_id = "stub"
+    soundcloud._session.mount("https://", StubAdapter({
+        "/search": static(soundcloud_search_payload("https://api-v2.soundcloud.com/media/stub/stream/hls")),
+        "/media/stub/stream/hls": static({"url": "https://cf-hls-media.sndcdn.com/playlist.m3u8"}),
+        "/playlist.m3u8": static(playlist, "application/vnd.apple.mpegurl"),
+        "/media/": static(b"\xff" * segment_bytes, "audio/mpeg"),
+    }))
+
+    for _ in range(songs):
+        genius.get_lyrics(genius.search("stub"))
+
+        result = soundcloud.search("stub")
+        soundcloud.download_audio_buffer(result.get_transcoding("audio/mpeg"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--songs", type=int, default=4)
+    parser.add_argument("--duration-s", type=float, default=120.0)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--band-width", type=int, default=256)
+    parser.add_argument("--segments", type=int, default=60)
+    parser.add_argument("--segment-bytes", type=int, default=160_000)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    profiler = Profiler()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # songs of different lengths, as `align_many` batches by length
+        jobs = [
+            write_song(tmp_dir, i, args.duration_s * (0.5 + i / max(args.songs - 1, 1)))
+            for i in range(args.songs)
+        ]
+
+        with profiler.active(trace_memory=args.trace_memory):
+            bench_aligner(jobs, args.batch_size, args.workers, args.band_width)
+            bench_clients(args.songs, args.segments, args.segment_bytes)
+
+    print(profiler.report())
+
+
+if __name__ == "__main__":
+    main()
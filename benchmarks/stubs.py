@@ -0,0 +1,150 @@
+"""
+Stand-ins for the acoustic model and for the HTTP servers the clients talk to, so the
+benchmarks run offline and on the CPU.
+"""
+
+from __future__ import annotations
+import io
+import json
+from typing import Callable, Union
+from urllib.parse import urlsplit
+import requests
+import torch
+from requests.adapters import BaseAdapter
+from lync.aligner import EMISSION_STRIDE
+
+Body = Union[bytes, str, dict]
+Route = Callable[[requests.PreparedRequest], tuple[int, str, Body]]
+
+
+class StubModel(torch.nn.Module):
+    """
+    Acoustic model with the interface of a torchaudio wav2vec2 model: it maps a batch of
+    waveforms to one frame of `num_labels` logits per `EMISSION_STRIDE` samples (minus one,
+    like wav2vec2's feature encoder) by a fixed random projection of the samples.
+    """
+
+    def __init__(self, num_labels: int, seed: int = 0) -> None:
+        super().__init__()
+
+        generator = torch.Generator().manual_seed(seed)
+        self.projection = torch.nn.Parameter(
+            torch.randn(EMISSION_STRIDE, num_labels, generator=generator), requires_grad=False
+        )
+
+    def forward(self, waveforms: torch.Tensor) -> tuple[torch.Tensor, None]:
+        num_frames = max(waveforms.size(1) // EMISSION_STRIDE - 1, 1)
+        frames = waveforms[:, :num_frames * EMISSION_STRIDE].reshape(waveforms.size(0), num_frames, EMISSION_STRIDE)
+
+        return frames @ self.projection, None
+
+
+class StubAdapter(BaseAdapter):
+    """
+    `requests` transport adapter answering requests from `routes`, which map URL paths (the
+    longest matching prefix wins) to functions returning the status, content type and body
+    of the response. Mount it on a session in place of the network:
+    ```
+    session.mount("https://", StubAdapter({"/search": search_route}))
+    ```
+    """
+
+    def __init__(self, routes: dict[str, Route]) -> None:
+        super().__init__()
+        self.routes = routes
+        self.requests = 0
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        self.requests += 1
+        path = urlsplit(request.url).path
+        matches = [prefix for prefix in self.routes if path.startswith(prefix)]
+
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+
+        if not matches:
+            response.status_code = 404
+            response._content = b""
+            response._content_consumed = True
+            return response
+
+        status, content_type, body = self.routes[max(matches, key=len)](request)
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+
+        response.status_code = status
+        response.headers["Content-Type"] = content_type
+        response._content = body
+        # the body is already read, also for streaming requests
+        response._content_consumed = True
+        response.raw = io.BytesIO(body)
+        response.encoding = "utf-8"
+
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def static(body: Body, content_type: str = "application/json", status: int = 200) -> Route:
+    return lambda _: (status, content_type, body)
+
+
+def genius_search_payload(title: str, url: str, image_url: str) -> dict:
+    result = {
+        "title": title,
+        "artist_names": "Stub Artist",
+        "url": url,
+        "song_art_image_url": image_url,
+        "stats": {"pageviews": 1},
+    }
+
+    return {
+        "meta": {"status": 200},
+        "response": {"sections": [{"type": "song", "hits": [{"result": result}]}]},
+    }
+
+
+def genius_lyrics_page(transcript: str, padding_bytes: int = 500_000) -> str:
+    """
+    Return a lyrics page whose embedded state holds the lines of `transcript`, preceded by
+    `padding_bytes` of unrelated state, as on real pages.
+    """
+
+    children: list = []
+    for line in transcript.split("\n"):
+        children += [line, {"tag": "br"}]
+
+    state = {
+        "songPage": {
+            "padding": "x" * padding_bytes,
+            "lyricsData": {"body": {"children": [{"tag": "root", "children": children}]}},
+        }
+    }
+    literal = json.dumps(state).replace("\\", "\\\\").replace("'", "\\'").replace('"', '\\"')
+
+    return f"<html><script>window.__PRELOADED_STATE__ = JSON.parse('{literal}');</script></html>"
+
+
+def soundcloud_search_payload(transcoding_url: str) -> dict:
+    track = {
+        "kind": "track",
+        "title": "Stub Song",
+        "publisher_metadata": {"artist": "Stub Artist"},
+        "artwork_url": "https://i1.sndcdn.com/artwork.jpg",
+        "media": {
+            "transcodings": [
+                {
+                    "url": transcoding_url,
+                    "preset": "mp3_0_0",
+                    "duration": 240000,
+                    "format": {"protocol": "hls", "mime_type": "audio/mpeg"},
+                }
+            ]
+        },
+    }
+
+    return {"collection": [track]}
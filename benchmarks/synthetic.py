@@ -0,0 +1,168 @@
+"""
+Synthetic emissions for benchmarking the alignment stages without audio or a GPU.
+"""
+
+from __future__ import annotations
+import json
+import random
+from typing import Optional
+import torch
+from lync.aligner import EMISSION_STRIDE, _line_words, clean_transcript
+
+# labels of torchaudio's WAV2VEC2_ASR_BASE_960H bundle
+LABELS = (
+    "-", "|", "E", "T", "A", "O", "N", "I", "H", "S", "R", "D", "L", "U", "M", "W", "C", "F",
+    "G", "Y", "P", "B", "V", "K", "'", "X", "J", "Q", "Z",
+)
+SAMPLE_RATE = 16000
+FRAME_S = EMISSION_STRIDE / SAMPLE_RATE
+
+# Logit boosts of the blank and of a token on the frame it is emitted on. The blank is
+# boosted enough to cost almost nothing between spikes: otherwise a path ending at the best
+# frame (rather than the last one) saves more by squeezing the tokens into the first frames
+# of a long song than it loses by missing their spikes.
+BLANK_BOOST = 8.0
+TOKEN_BOOST = 14.0
+
+Spike = tuple[int, int]
+
+
+def peaky_emission(spikes: list[Spike], num_frames: int, noise: float = 1.0, seed: int = 0) -> torch.Tensor:
+    """
+    Return a CTC-like log-softmax emission of `num_frames` frames over `LABELS` that is
+    blank everywhere except for a spike of each `(token, frame)` in `spikes`, with
+    Gaussian noise of standard deviation `noise` on all logits.
+    """
+
+    generator = torch.Generator().manual_seed(seed)
+    logits = torch.randn(num_frames, len(LABELS), generator=generator) * noise
+    logits[:, 0] += BLANK_BOOST
+
+    if spikes:
+        tokens, frames = zip(*spikes)
+        logits[list(frames), list(tokens)] += TOKEN_BOOST
+
+    return torch.log_softmax(logits, dim=-1)
+
+
+def random_transcript(num_tokens: int, seed: int = 0, words_per_line: int = 6) -> str:
+    """
+    Return a transcript of random words whose cleaned form has about `num_tokens` tokens.
+    """
+
+    rng = random.Random(seed)
+    letters = [label for label in LABELS if label.isalpha()]
+    lines, words = [], []
+    length = 0
+
+    while length < num_tokens:
+        word = "".join(rng.choice(letters) for _ in range(rng.randint(2, 8)))
+        words.append(word)
+        length += len(word) + 1
+
+        if len(words) == words_per_line:
+            lines.append(" ".join(words))
+            words = []
+
+    if words:
+        lines.append(" ".join(words))
+
+    return "\n".join(lines)
+
+
+def tokenize(transcript: str) -> list[int]:
+    dictionary = {c: i for i, c in enumerate(LABELS)}
+    return [dictionary[c] for c in clean_transcript(transcript)]
+
+
+def uniform_emission(transcript: str, num_frames: int, noise: float = 1.0, seed: int = 0) -> tuple[torch.Tensor, list[int]]:
+    """
+    Return an emission of `num_frames` frames in which the tokens of `transcript` are
+    spread evenly, and the tokens.
+    """
+
+    tokens = tokenize(transcript)
+    if num_frames < 2 * len(tokens):
+        raise ValueError("Not enough frames for the transcript")
+
+    step = num_frames / (len(tokens) + 1)
+    spikes = [(token, int((k + 0.5) * step)) for k, token in enumerate(tokens)]
+
+    return peaky_emission(spikes, num_frames, noise, seed), tokens
+
+
+class ReferenceSong:
+    """
+    A song rebuilt from a reference alignment (the transcript JSON written by
+    `lync.aligner.export_transcript`): a transcript of the words of its lines, and an
+    emission in which the characters of every line are spread over the frames between the
+    line's `begin` and `end`, followed by the separator at its end.
+    """
+
+    lines: list[str]
+    begins: list[float]
+    ends: list[float]
+    transcript: str
+    tokens: list[int]
+    emission: torch.Tensor
+
+    def __init__(self, reference_path: str, noise: float = 1.0, seed: int = 0, tail_s: float = 2.0) -> None:
+        with open(reference_path, "r") as fl:
+            fragments = json.load(fl)["fragments"]
+
+        self.lines, self.begins, self.ends = [], [], []
+        dictionary = {c: i for i, c in enumerate(LABELS)}
+        spikes: list[Spike] = []
+        last_frame = -1
+
+        for fragment in fragments:
+            words = _line_words(fragment["lines"][0])
+            begin, end = float(fragment["begin"]), float(fragment["end"])
+            if not words or end <= begin:
+                continue
+
+            line_tokens = [dictionary[c] for c in "|".join(words)]
+            first = max(round(begin / FRAME_S), last_frame + 1)
+            # the separator after the line marks its end
+            separator = max(round(end / FRAME_S), first + 2 * len(line_tokens))
+            step = (separator - first) / len(line_tokens)
+
+            if spikes:
+                spikes.append((dictionary["|"], last_frame))
+            spikes += [(token, first + int(k * step)) for k, token in enumerate(line_tokens)]
+
+            self.lines.append(" ".join(words))
+            self.begins.append(first * FRAME_S)
+            self.ends.append(separator * FRAME_S)
+            last_frame = separator
+
+        num_frames = last_frame + round(tail_s / FRAME_S)
+        self.transcript = "\n".join(self.lines)
+        self.tokens = tokenize(self.transcript)
+        self.emission = peaky_emission(spikes, num_frames, noise, seed)
+
+    @property
+    def num_frames(self) -> int:
+        return self.emission.size(0)
+
+
+def boundary_errors(
+    begins: list[float], ends: list[float], reference_begins: list[float], reference_ends: list[float]
+) -> dict[str, Optional[float]]:
+    """
+    Return the mean and maximum absolute error of line boundaries against a reference, and
+    the fraction of boundaries within 0.1 seconds of it.
+    """
+
+    errors = [abs(a - b) for a, b in zip(begins, reference_begins)]
+    # lines without words have no end
+    errors += [abs(a - b) for a, b in zip(ends, reference_ends) if a >= 0]
+
+    if not errors:
+        return {"mean_error_s": None, "max_error_s": None, "within_100ms": None}
+
+    return {
+        "mean_error_s": sum(errors) / len(errors),
+        "max_error_s": max(errors),
+        "within_100ms": sum(error <= 0.1 for error in errors) / len(errors),
+    }
@@ -1,14 +1,20 @@
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 import json
 import math
 import sys
 
+import numpy as np
 import torch
 import torchaudio
 
+from .emission_cache import EmissionCache, hash_audio
+from .profiling import count, profiled, stage
+
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+@profiled("aligner.get_trellis")
 def get_trellis(emission, tokens, blank_id=0):
         num_frame = emission.size(0)
         num_tokens = len(tokens)
@@ -37,6 +43,7 @@ class Point:
     time_index: int
     score: float
 
+@profiled("aligner.backtrack")
 def backtrack(trellis, emission, tokens, blank_id=0):
     # Note:
     # j and t are indices for trellis, which has extra dimensions
@@ -72,6 +79,471 @@ def backtrack(trellis, emission, tokens, blank_id=0):
         raise ValueError("Failed to align")
     return path[::-1]
 
+@dataclass
+class BandedTrellis:
+    """
+    Trellis restricted to a diagonal band. Trellis column `j` only holds the frames
+    `offsets[j] <= t < offsets[j] + band_width`; every cell outside the band is -inf.
+
+    Only the decisions are kept: `decisions` holds one bit per cell, set if the cell was
+    entered by changing token; bit `i + 1` of a column is cell `i`. `final` holds the
+    scores of the last column.
+
+    Paths leaving the band are accounted for by upper bounds on their scores: a cell that
+    got its score from such a bound is entered from, or stays on from, a cell outside of
+    the band. `final_bound` bounds the score of the paths ending outside the band of the
+    last column. Paths entering the last token above its band are held on it until the last
+    frame, as are the paths leaving the top of the band; so that they can be compared,
+    `hold_bound` bounds their score less the blanks held after the top.
+    """
+
+    offsets: torch.Tensor
+    num_frame: int
+    final: torch.Tensor
+    decisions: torch.Tensor
+    final_bound: float = -float("inf")
+    hold_bound: float = -float("inf")
+
+    @property
+    def band_width(self):
+        return self.final.size(0)
+
+_BIT_WEIGHTS = torch.tensor([128, 64, 32, 16, 8, 4, 2, 1], dtype=torch.uint8)
+# number of trellis columns whose decisions are packed at once
+_DECISION_BLOCK = 256
+# number of blocks of frames per band width in the bounds on paths leaving the band
+_BOUND_BLOCKS = 8
+
+def _pack_bits(bits):
+    """
+    Pack the last dimension of a boolean tensor into uint8, most significant bit first.
+    """
+
+    padding = -bits.size(-1) % 8
+    if padding:
+        bits = torch.cat([bits, bits.new_zeros(*bits.shape[:-1], padding)], -1)
+    bits = bits.view(*bits.shape[:-1], -1, 8).to(torch.uint8)
+    return (bits * _BIT_WEIGHTS).sum(-1, dtype=torch.uint8)
+
+def _row_gains(emission_t, blank_id):
+    """
+    Return the gain over a blank of entering each label on each trellis row, that is, of
+    emitting it on the frame before the row; no label can be entered on row 0.
+    """
+
+    gains = emission_t - emission_t[blank_id]
+    return torch.cat([gains.new_full((gains.size(0), 1), -float("inf")), gains], 1)
+
+def _window_gains(row_gains, block, num_tokens):
+    """
+    Return the largest gain of each label over every window of `block` trellis rows, such
+    that element `block + t` covers the rows `t <= r < t + block`. The result is padded
+    with -inf so that taking every `block`-th element from element `j <= num_tokens` gives
+    as many elements as there are blocks of rows, plus one.
+    """
+
+    num_labels, num_rows = row_gains.size()
+    num_blocks = math.ceil(num_rows / block)
+
+    padding = row_gains.new_full((num_labels, block - 1), -float("inf"))
+    windows = torch.cat([row_gains, padding], 1).unfold(1, block, 1).amax(2)
+
+    front = row_gains.new_full((num_labels, block), -float("inf"))
+    back = row_gains.new_full((num_labels, num_tokens + (num_blocks + 1) * block - num_rows), -float("inf"))
+    return torch.cat([front, windows, back], 1)
+
+@profiled("aligner.get_banded_trellis")
+def get_banded_trellis(emission, tokens, band_width, centers=None, blank_id=0):
+    """
+    Compute the trellis of `get_trellis`, but only for `band_width` frames around the
+    expected frame of every token. `centers[j]` is the expected frame of trellis column `j`;
+    if omitted, the band follows the straight diagonal from the first to the last frame.
+    A `band_width` of `num_frame + 1` or more computes the full trellis.
+
+    The last token is entered on the frame after the previous one is left, and then held
+    until the path ends, so the band of the last column starts right after the band of the
+    previous one and covers every frame it can be entered on from there.
+
+    Cells on the border of the band may also be reached by paths leaving it. Those are not
+    followed; instead, their scores are bounded from above by a relaxation of the trellis,
+    and the bound competes with the paths in the band. Token `j` is entered on row
+    `j + u[j]` of a path, with `u` never decreasing; the relaxation only knows `u[j]` to a
+    block of frames, within which the token scores its best frame. Below the top of its
+    band, the relaxation of a column is tightened to the scores of the band. A path that is
+    backtracked without passing through a bound (see `BandedTrellis`) therefore scores at
+    least as well as any path leaving the band.
+
+    Columns are filled one token at a time, each as a single vectorized pass over the frames
+    of its band. Only the decision bits are kept for the backtrack, which is an eighth of a
+    byte per cell.
+    """
+
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+    width = min(band_width, num_frame + 1)
+    bounded = width < num_frame + 1
+
+    # Scores are accumulated in double precision: the cumulative blank scores below grow
+    # with the track length and float32 would lose the differences between neighbours.
+    emission = emission.double()
+    # Transposed so that the frames of a single label are contiguous.
+    emission_t = emission.t().contiguous()
+
+    # stay[t] is the score of emitting blanks for every frame before trellis row t.
+    stay = torch.zeros(num_frame + 1, dtype=torch.float64)
+    stay[1:] = torch.cumsum(emission_t[blank_id], 0)
+    # Staying on a token only ever adds blank scores, so relative to `stay` the recurrence
+    # `max(stay, change)` becomes a running maximum, and changing token adds the gain of the
+    # token over the blank. Columns are kept relative to `stay` below.
+    gains = _row_gains(emission_t, blank_id)
+
+    if centers is None:
+        centers = torch.arange(num_tokens + 1, dtype=torch.float64) * (num_frame / max(num_tokens, 1))
+    offsets = (centers - width / 2).round().long().clamp(0, num_frame + 1 - width)
+    # the path never moves backwards in time, so neither may the band
+    offsets = torch.cummax(offsets, 0).values
+    if num_tokens > 0:
+        offsets[-1] = min(offsets[-2].item() + 1, num_frame + 1 - width)
+    starts = offsets.tolist()
+
+    decisions = torch.zeros((num_tokens + 1, (width + 8) // 8), dtype=torch.uint8)
+    entered = torch.zeros((_DECISION_BLOCK, width + 1), dtype=torch.bool)
+    # Columns are kept with the paths from below the band in front, so element `i + 1` is
+    # cell `i`.
+    cells = torch.arange(width + 1)
+    gain_rows = list(gains)
+
+    # <SoS> column, identical to the one in `get_trellis`; `from_first[t]` is its score on
+    # row `t - 1`
+    first = torch.zeros(num_frame + 1, dtype=torch.float64)
+    first[max(num_frame + 1 - num_tokens, 0):] = float("inf")
+    from_first = torch.cat([first.new_full((1,), -float("inf")), first[:-1]])
+    below = torch.full((1,), -float("inf"), dtype=torch.float64)
+    column = torch.cat([below, first[starts[0]:starts[0] + width]])
+
+    if bounded:
+        # `relaxed[k]` bounds the score of column `j` on the rows `t <= j + k * block - 1`;
+        # `relaxed[0]` is for the rows before `j`, which it cannot reach. Row `t` of column
+        # `j` is bounded by `relaxed[max(0, (t - j) // block + 1)]`.
+        block = max(1, width // _BOUND_BLOCKS)
+        window_rows = list(_window_gains(gains, block, num_tokens))
+        num_blocks = math.ceil((num_frame + 1) / block)
+        relaxed = torch.zeros(num_blocks + 1, dtype=torch.float64)
+        relaxed[0] = -float("inf")
+        rows = torch.arange(num_frame + 1)
+        block_of = (torch.arange(-num_tokens - 1, num_frame + 1) // block + 1).clamp(min=0)
+    else:
+        outside = torch.full((width,), -float("inf"), dtype=torch.float64)
+
+    for j in range(1, num_tokens + 1):
+        prev = column
+        start = starts[j]
+        token_gains = gain_rows[tokens[j - 1]][start:start + width]
+        # Row `start + i` of this column can be entered from row `start + i - 1` of the
+        # previous one, i.e. from cell `i + shift` of the previous band. The band never
+        # moves backwards, so `shift >= -1`.
+        shift = start - 1 - starts[j - 1]
+
+        if bounded:
+            prev_relaxed = relaxed
+            block_gains = window_rows[tokens[j - 1]][j:j + (num_blocks + 1) * block:block]
+            relaxed = torch.cummax(relaxed + block_gains, 0).values
+
+        if j == 1:
+            # the <SoS> column is known outside of its band too
+            changed = from_first[start:start + width] + token_gains
+        elif shift == 0:
+            changed = prev[1:] + token_gains
+        else:
+            # entering from outside of the previous band is bounded
+            kept = prev[max(0, shift) + 1:width + shift + 1]
+            if not bounded:
+                source = torch.cat([outside[:1], kept] if shift < 0 else [kept, outside[len(kept):]])
+            elif shift < 0:
+                k = max(0, (start - j) // block + 1)
+                source = torch.cat([prev_relaxed[k:k + 1], kept])
+            else:
+                k = start - j + num_tokens + 1
+                source = torch.cat([kept, prev_relaxed[block_of[k + len(kept):k + width]]])
+            changed = source + token_gains
+
+        if bounded and start > 0:
+            # as is staying on from below the band
+            k = max(0, (start - 1 - j) // block + 1)
+            below = relaxed[k:k + 1]
+
+        column, source = torch.cummax(torch.cat([below, changed]), 0)
+
+        if bounded:
+            # Scores never decrease down a column, so the rows up to the top of the band
+            # score at most as well as the band does on the last of them, or on its bottom.
+            under = max(0, (start - j) // block)
+            inside = max(0, (start + width - j) // block)
+            relaxed[1:under + 1].clamp_(max=column[1])
+            if under < inside:
+                first_row = (under + 1) * block + j - start
+                torch.minimum(
+                    relaxed[under + 1:inside + 1],
+                    column[first_row:first_row + (inside - under - 1) * block + 1:block],
+                    out=relaxed[under + 1:inside + 1],
+                )
+
+        # a cell whose running maximum is its own change score was entered from the
+        # previous token
+        row = j % _DECISION_BLOCK
+        entered[row] = source == cells
+        if row == _DECISION_BLOCK - 1 or j == num_tokens:
+            decisions[j - row:j + 1] = _pack_bits(entered[:row + 1])
+
+    start = starts[-1]
+    top = start + width - 1
+    final_bound, hold_bound = -float("inf"), -float("inf")
+    if bounded and num_tokens > 0:
+        # Paths ending outside of the band entered the last token there, and ones leaving the
+        # top of it hold the last token from there: that only ever adds blank scores.
+        entered = prev_relaxed[block_of[1:num_frame + 2]] + gains[tokens[-1]]
+        outside = (rows < start) | (rows > top)
+        final_bound = (stay + entered)[outside].max().item()
+
+        if top < num_frame:
+            hold_bound = stay[top].item() + entered[top + 1:].max().item()
+
+    final = stay[start:start + width] + column[1:]
+    return BandedTrellis(offsets, num_frame, final, decisions, final_bound, hold_bound)
+
+@dataclass
+class PathArrays:
+    """
+    Alignment path as parallel arrays: emission frame `time_index[k]` is aligned to
+    transcript token `token_index[k]` with probability `score[k]`.
+    """
+
+    token_index: torch.Tensor
+    time_index: torch.Tensor
+    score: torch.Tensor
+
+    def __len__(self):
+        return self.time_index.size(0)
+
+    def to_points(self):
+        return [
+            Point(token_index, time_index, score)
+            for token_index, time_index, score in zip(
+                self.token_index.tolist(), self.time_index.tolist(), self.score.tolist()
+            )
+        ]
+
+    @staticmethod
+    def from_points(path):
+        return PathArrays(
+            torch.tensor([point.token_index for point in path], dtype=torch.long),
+            torch.tensor([point.time_index for point in path], dtype=torch.long),
+            torch.tensor([point.score for point in path]),
+        )
+
+@profiled("aligner.backtrack_path")
+def backtrack_path(trellis, emission, tokens, blank_id=0, anchored=False):
+    """
+    Backtrack a `BandedTrellis`, returning `PathArrays`.
+    Raises `ValueError` if the band does not contain a complete path, or if a path leaving
+    the band may score better (see `get_banded_trellis`); the path is optimal otherwise.
+
+    The path ends at the best scoring frame of the last token, or at the last frame if
+    `anchored` is set.
+    """
+
+    num_tokens = len(tokens)
+    num_frame = trellis.num_frame
+    width = trellis.band_width
+    offsets = trellis.offsets.tolist()
+
+    top = offsets[-1] + width - 1
+    if anchored:
+        # above the band, the last token is held from the top of it
+        t_end, best = num_frame, min(num_frame, top) - offsets[-1]
+        score, bound = trellis.final[best].item(), trellis.hold_bound
+    else:
+        best = torch.argmax(trellis.final).item()
+        t_end, score, bound = offsets[-1] + best, trellis.final[best].item(), trellis.final_bound
+    if score == -float("inf"):
+        raise ValueError("Failed to align")
+    if bound >= score:
+        raise ValueError("Path may end outside of the band")
+
+    # Only the trellis row at which each token is entered is recorded here; the rest of the
+    # path follows from those rows with array operations.
+    bits = trellis.decisions.numpy().tobytes()
+    row_bytes = trellis.decisions.size(1)
+    entries = [0] * num_tokens
+    t, j = offsets[-1] + best, num_tokens
+    while j > 0:
+        i = t - offsets[j]
+        if t <= 0:
+            raise ValueError("Failed to align")
+        if not 0 <= i < width:
+            # the cell took its score from outside of the band
+            raise ValueError("Path may leave the band")
+        # bit `i + 1` is cell `i`
+        if bits[j * row_bytes + ((i + 1) >> 3)] & (0x80 >> ((i + 1) & 7)):
+            entries[j - 1] = t
+            j -= 1
+        t -= 1
+
+    entry = torch.tensor(entries, dtype=torch.long)
+    exit = torch.cat([entry[1:] - 1, torch.tensor([t_end])])
+
+    counts = exit - entry + 1
+    token_index = torch.repeat_interleave(torch.arange(num_tokens), counts)
+    # trellis row `t` corresponds to emission frame `t - 1`
+    time_index = torch.arange(entries[0] - 1, t_end)
+
+    # frames where a token is entered score the token, all others score a blank
+    changed = torch.zeros(len(time_index), dtype=torch.bool)
+    changed[entry - entry[:1]] = True
+    labels = torch.full_like(token_index, blank_id)
+    labels[changed] = torch.tensor(tokens, dtype=torch.long)[token_index[changed]]
+
+    return PathArrays(token_index, time_index, emission[time_index, labels].exp())
+
+@profiled("aligner.coarse_entries")
+def coarse_entries(emission, tokens, factor, blank_id=0, anchored=False):
+    """
+    Return the trellis rows the tokens are entered on in a coarse alignment, in which the
+    frame each token is entered on is only known to `factor` frames: the relaxation that
+    `get_banded_trellis` bounds paths leaving the band with. Unlike an alignment of a
+    downsampled emission, several tokens can be entered within `factor` frames. Returns
+    `None` if the coarse alignment fails.
+    """
+
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+    if num_tokens == 0:
+        return None
+
+    emission_t = emission.double().t().contiguous()
+    stay = torch.zeros(num_frame + 1, dtype=torch.float64)
+    stay[1:] = torch.cumsum(emission_t[blank_id], 0)
+    window_gains = _window_gains(_row_gains(emission_t, blank_id), factor, num_tokens).numpy()
+    num_blocks = math.ceil((num_frame + 1) / factor)
+
+    # `relaxed[k]` is the best score, relative to `stay`, of entering token `j` on a row
+    # `j + u` with `(k - 1) * factor <= u < k * factor`, or earlier
+    relaxed = np.zeros(num_blocks + 1)
+    relaxed[0] = -np.inf
+    gains = np.empty(num_blocks + 1)
+    decisions = np.zeros((num_tokens + 1, (num_blocks + 8) // 8), dtype=np.uint8)
+    entered = np.zeros((_DECISION_BLOCK, num_blocks + 1), dtype=bool)
+
+    # There is one step per token, on rows of a few hundred to a few thousand blocks, for
+    # which the per-call overhead of torch outweighs the work; numpy updates them in place.
+    for j in range(1, num_tokens + 1):
+        np.add(relaxed, window_gains[tokens[j - 1], j:j + (num_blocks + 1) * factor:factor], out=gains)
+        np.maximum.accumulate(gains, out=relaxed)
+
+        # the token is entered in a block unless an earlier block scores higher
+        row = j % _DECISION_BLOCK
+        np.equal(gains, relaxed, out=entered[row])
+        if row == _DECISION_BLOCK - 1 or j == num_tokens:
+            decisions[j - row:j + 1] = np.packbits(entered[:row + 1], axis=1)
+
+    relaxed = torch.from_numpy(relaxed)
+
+    if anchored:
+        k = (num_frame - num_tokens) // factor + 1
+    else:
+        # the last token is entered no earlier than the first row of its block
+        blocks = torch.arange(num_blocks + 1)
+        first_rows = (num_tokens + (blocks[1:] - 1) * factor).clamp(max=num_frame)
+        k = torch.argmax(relaxed[1:] + stay[first_rows]).item() + 1
+    if num_frame < num_tokens or relaxed[k].item() == -float("inf"):
+        return None
+
+    bits = decisions.tobytes()
+    row_bytes = decisions.shape[1]
+    token_blocks = [0] * num_tokens
+    j = num_tokens
+    while j > 0:
+        if k <= 0:
+            return None
+        if bits[j * row_bytes + (k >> 3)] & (0x80 >> (k & 7)):
+            token_blocks[j - 1] = k
+            j -= 1
+        else:
+            k -= 1
+
+    # token `j` is entered on about the middle of its block of rows
+    return (
+        torch.arange(1, num_tokens + 1, dtype=torch.float64)
+        + (torch.tensor(token_blocks, dtype=torch.float64) - 0.5) * factor
+    ).clamp(max=num_frame)
+
+def band_centers(entries, num_frame, anchored=False):
+    """
+    Place the band for `get_banded_trellis` on a path that enters the tokens on the trellis
+    rows `entries`, ending at the last frame if `anchored` is set.
+    """
+
+    end = num_frame + 1 if anchored else entries[-1].item() + 1
+
+    # Column `j` is occupied from the row token `j` is entered on until the next one is,
+    # and the last column until the end of the path; the band is centered on the middle of
+    # that span.
+    bounds = torch.cat([
+        torch.zeros(1, dtype=torch.float64),
+        entries,
+        torch.tensor([end], dtype=torch.float64),
+    ])
+    return (bounds[:-1] + bounds[1:]) / 2
+
+@profiled("aligner.coarse_band_centers")
+def coarse_band_centers(emission, tokens, factor, blank_id=0, anchored=False):
+    """
+    Place the band for `get_banded_trellis` on the coarse alignment of `coarse_entries`.
+    Returns `None` if the coarse alignment fails.
+    """
+
+    entries = coarse_entries(emission, tokens, factor, blank_id, anchored)
+    if entries is None:
+        return None
+    return band_centers(entries, emission.size(0), anchored)
+
+def get_trellis_path(emission, tokens, band_width=None, coarse_factor=None, blank_id=0, anchored=False, centers=None):
+    """
+    `get_path`, also returning the `BandedTrellis` the path was backtracked from, as
+    `(trellis, path)`. The band is placed on `centers` if given, instead of following the
+    diagonal or a coarse alignment.
+    """
+
+    num_frame = emission.size(0)
+
+    if band_width is not None and band_width < num_frame + 1:
+        if centers is None and coarse_factor:
+            centers = coarse_band_centers(emission, tokens, coarse_factor, blank_id, anchored)
+
+        try:
+            trellis = get_banded_trellis(emission, tokens, band_width, centers, blank_id)
+            return trellis, backtrack_path(trellis, emission, tokens, blank_id, anchored)
+        except ValueError:
+            count("aligner.band_fallbacks")
+
+    trellis = get_banded_trellis(emission, tokens, num_frame + 1, blank_id=blank_id)
+    return trellis, backtrack_path(trellis, emission, tokens, blank_id, anchored)
+
+@profiled("aligner.get_path")
+def get_path(emission, tokens, band_width=None, coarse_factor=None, blank_id=0, anchored=False):
+    """
+    Align `tokens` to `emission`, returning the path as `PathArrays`.
+
+    If `band_width` is given, only a diagonal band of that many frames around each token is
+    searched. The band follows the diagonal of the trellis unless `coarse_factor` is given,
+    in which case it follows a coarse alignment that only knows the frame of each token to
+    `coarse_factor` frames (see `coarse_band_centers`). If the band does not contain a path
+    that is provably the best one, the full trellis is used instead. See `backtrack_path`
+    for `anchored`.
+    """
+
+    return get_trellis_path(emission, tokens, band_width, coarse_factor, blank_id, anchored)[1]
+
 @dataclass
 class Segment:
     label: str
@@ -86,6 +558,7 @@ class Segment:
     def length(self):
         return self.end - self.start
 
+@profiled("aligner.merge_repeats")
 def merge_repeats(trellis_path, transcript):
     i1, i2 = 0, 0
     segments = []
@@ -104,6 +577,7 @@ def merge_repeats(trellis_path, transcript):
         i1 = i2
     return segments
 
+@profiled("aligner.merge_words")
 def merge_words(segments, separator="|"):
     words = []
     i1, i2 = 0, 0
@@ -119,6 +593,88 @@ def merge_words(segments, separator="|"):
         else:
             i2 += 1
     return words
+
+@dataclass
+class SegmentArrays:
+    """
+    Segments as parallel arrays. Segment `k` spans the transcript characters
+    `[token_start[k], token_end[k])` and the frames `[start[k], end[k])`.
+    """
+
+    token_start: torch.Tensor
+    token_end: torch.Tensor
+    start: torch.Tensor
+    end: torch.Tensor
+    score: torch.Tensor
+
+    def __len__(self):
+        return self.start.size(0)
+
+    def to_segments(self, transcript):
+        return [
+            Segment(transcript[token_start:token_end], start, end, score)
+            for token_start, token_end, start, end, score in zip(
+                self.token_start.tolist(),
+                self.token_end.tolist(),
+                self.start.tolist(),
+                self.end.tolist(),
+                self.score.tolist(),
+            )
+        ]
+
+def _group_sums(values, starts, ends):
+    """
+    Sum `values` over each of the consecutive groups `[starts[k], ends[k])`.
+    """
+
+    sums = torch.zeros(len(values) + 1, dtype=torch.float64)
+    sums[1:] = torch.cumsum(values.double(), 0)
+    return sums[ends] - sums[starts]
+
+@profiled("aligner.merge_repeats_arrays")
+def merge_repeats_arrays(path):
+    """
+    `merge_repeats` for `PathArrays`.
+    """
+
+    _, counts = torch.unique_consecutive(path.token_index, return_counts=True)
+    ends = torch.cumsum(counts, 0)
+    starts = ends - counts
+
+    return SegmentArrays(
+        token_start=path.token_index[starts],
+        token_end=path.token_index[starts] + 1,
+        start=path.time_index[starts],
+        end=path.time_index[ends - 1] + 1,
+        score=_group_sums(path.score, starts, ends) / counts,
+    )
+
+@profiled("aligner.merge_words_arrays")
+def merge_words_arrays(segments, transcript, separator="|"):
+    """
+    `merge_words` for `SegmentArrays`.
+    """
+
+    is_separator = torch.tensor([c == separator for c in transcript], dtype=torch.bool)
+    is_separator = is_separator[segments.token_start]
+    kept = ~is_separator
+
+    # every run of segments between two separators is a word
+    _, counts = torch.unique_consecutive(torch.cumsum(is_separator, 0)[kept], return_counts=True)
+    ends = torch.cumsum(counts, 0)
+    starts = ends - counts
+
+    start, end = segments.start[kept], segments.end[kept]
+    length = end - start
+    score = _group_sums(segments.score[kept] * length, starts, ends) / _group_sums(length, starts, ends)
+
+    return SegmentArrays(
+        token_start=segments.token_start[kept][starts],
+        token_end=segments.token_end[kept][ends - 1],
+        start=start[starts],
+        end=end[ends - 1],
+        score=score,
+    )
     
 @dataclass
 class TranscriptLine:
@@ -133,6 +689,11 @@ class TranscriptLine:
     def duration(self):
         return self.end_time_s - self.start_time_s
 
+def _line_words(line):
+    line_cleaned = line.strip().upper()
+    return ''.join(filter(lambda chr: chr.isalpha() or chr == " ", line_cleaned)).split()
+
+@profiled("aligner.merge_lines")
 def merge_lines(word_segs, lyric_lines, waveform_len, srate = 44100):
     num_frames = word_segs[-1].end
 
@@ -144,10 +705,8 @@ def merge_lines(word_segs, lyric_lines, waveform_len, srate = 44100):
             continue
 
         line_segment = TranscriptLine(line, word_segs[transcript_word_idx].start / num_frames * waveform_len / srate, -1)
-        line_cleaned = line.strip().upper()
-        line_cleaned = ''.join(filter(lambda chr: chr.isalpha() or chr == " ", line_cleaned)).split()
 
-        for word in line_cleaned:
+        for word in _line_words(line):
             line_segment.end_time_s = word_segs[transcript_word_idx].end / num_frames * waveform_len / srate
             transcript_word_idx+=1
     
@@ -155,6 +714,40 @@ def merge_lines(word_segs, lyric_lines, waveform_len, srate = 44100):
 
     return line_segments
 
+@profiled("aligner.merge_lines_arrays")
+def merge_lines_arrays(words, lyric_lines, waveform_len, srate = 44100):
+    """
+    `merge_lines` for word `SegmentArrays`.
+    """
+
+    num_frames = words.end[-1].item()
+    starts, ends = words.start.tolist(), words.end.tolist()
+
+    line_segments = []
+    transcript_word_idx = 0
+    for line in lyric_lines:
+        if line == "":
+            continue
+
+        num_words = len(_line_words(line))
+        start = starts[transcript_word_idx] / num_frames * waveform_len / srate
+        end = -1
+        if num_words:
+            end = ends[transcript_word_idx + num_words - 1] / num_frames * waveform_len / srate
+
+        line_segments.append(TranscriptLine(line, start, end))
+        transcript_word_idx += num_words
+
+    return line_segments
+
+def merge_emission_lines(words, lyric_lines, sample_rate):
+    """
+    `merge_lines_arrays` for words aligned to an emission of a waveform at `sample_rate`,
+    where every frame covers `EMISSION_STRIDE` samples.
+    """
+
+    return merge_lines_arrays(words, lyric_lines, words.end[-1].item() * EMISSION_STRIDE, sample_rate)
+
 def export_transcript(merged_lines, outfile):
     script = {}
     script['fragments'] = []
@@ -172,53 +765,431 @@ def export_transcript(merged_lines, outfile):
     
     json.dump(script, outfile)
 
-CHUNKS = 6
-def align(vocal_path, lyrics_path, outfile_path):
-    # prep lyrics
-    lyrics_file = open(lyrics_path, 'r')
-    transcript  = lyrics_file.read()
-    transcript_lines = transcript.split("\n")
+# wav2vec2's convolutional feature encoder emits one frame per 320 input samples
+EMISSION_STRIDE = 320
+WINDOW_S = 20.0
+OVERLAP_S = 1.0
+
+@dataclass
+class WindowPlan:
+    """
+    Windows of `length` samples covering a track, starting at the samples in `starts`. Both
+    are counted at the model's sample rate and are multiples of `EMISSION_STRIDE`, so window
+    frames line up with frames of the whole track. `discard` frames at the end of every
+    window but the last overlap with the next window and are dropped when stitching.
+    """
+
+    starts: list[int]
+    length: int
+    discard: int
+
+def plan_windows(num_samples, sample_rate, window_s=WINDOW_S, overlap_s=OVERLAP_S):
+    """
+    Split a track of `num_samples` samples into windows of `window_s` seconds that overlap
+    by `overlap_s` seconds. All windows have the same length, so any of them can be batched
+    together; the last one is moved back to end with the track.
+    """
+
+    window_frames = max(round(window_s * sample_rate / EMISSION_STRIDE), 2)
+    length = window_frames * EMISSION_STRIDE
+    if num_samples <= length:
+        return WindowPlan([0], num_samples, 0)
+
+    # A window of `n` strides only yields `n - 1` frames, so consecutive windows need to
+    # overlap by at least two frames for every frame of the track to be covered.
+    overlap_frames = min(max(round(overlap_s * sample_rate / EMISSION_STRIDE), 2), window_frames - 1)
+    hop = length - overlap_frames * EMISSION_STRIDE
+    last = (num_samples - length) // EMISSION_STRIDE * EMISSION_STRIDE
+
+    return WindowPlan(list(range(0, last, hop)) + [last], length, overlap_frames // 2)
+
+def _rewind(vocal_path):
+    # audio may also be given as a file object, e.g. `Soundcloud.download_audio_buffer`
+    if hasattr(vocal_path, "seek"):
+        vocal_path.seek(0)
+    return vocal_path
+
+def audio_info(vocal_path):
+    return torchaudio.info(_rewind(vocal_path))
+
+@profiled("aligner.load_window")
+def load_window(vocal_path, start, length, source_rate, sample_rate):
+    """
+    Load `length` samples of `vocal_path` from sample `start` on, both counted at
+    `sample_rate`, as a mono waveform resampled to `sample_rate`. `vocal_path` may also be
+    a seekable file object.
+    """
+
+    waveform, _ = torchaudio.load(
+        _rewind(vocal_path),
+        frame_offset=start * source_rate // sample_rate,
+        num_frames=-(-length * source_rate // sample_rate),
+    )
+    waveform = waveform.mean(0)
+
+    if source_rate != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, source_rate, sample_rate)
+
+    # rounding may leave the window a few samples short, e.g. at the end of the file
+    if waveform.size(0) < length:
+        waveform = torch.nn.functional.pad(waveform, (0, length - waveform.size(0)))
+    return waveform[:length]
+
+class EmissionStitcher:
+    """
+    Joins the emissions of the windows of a `WindowPlan` into the emission of the whole
+    track, dropping the frames where windows overlap. Windows must be added in order.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.next_frame = 0
+
+    def add(self, index, emission):
+        """
+        Return the frames of the emission of window `index` that belong in the output.
+        """
+
+        first_frame = self.plan.starts[index] // EMISSION_STRIDE
+        end = emission.size(0)
+        if index < len(self.plan.starts) - 1:
+            end -= self.plan.discard
+
+        piece = emission[max(self.next_frame - first_frame, 0):max(end, 0)]
+        self.next_frame = max(self.next_frame, first_frame + end)
+        return piece
+
+def infer_windows(model, windows, batch_size=1, device=DEVICE, dtype=torch.float32):
+    """
+    Run `(key, waveform)` pairs from `windows` through `model` in batches of up to
+    `batch_size` consecutive windows of equal length, yielding `(key, emission)` pairs in
+    order, where `emission` is the log-softmax output for that window. Waveforms are cast
+    to `dtype`, which must match the model's parameters.
+    """
+
+    def run(batch):
+        keys, waveforms = zip(*batch)
+        count("aligner.windows", len(batch))
+        with stage("aligner.inference"), torch.inference_mode():
+            emission, _ = model(torch.stack(waveforms).to(device, dtype))
+            emission = torch.log_softmax(emission.float(), dim=-1).cpu()
+        return zip(keys, emission)
+
+    batch = []
+    for key, waveform in windows:
+        if batch and (len(batch) == batch_size or waveform.size(0) != batch[0][1].size(0)):
+            yield from run(batch)
+            batch = []
+        batch.append((key, waveform))
+
+    if batch:
+        yield from run(batch)
+
+def stream_emissions(model, vocal_path, sample_rate, window_s=WINDOW_S, overlap_s=OVERLAP_S, batch_size=1, device=DEVICE, dtype=torch.float32):
+    """
+    Compute the emission of `vocal_path` window by window, yielding consecutive pieces of
+    the emission of the whole track. Audio is read and resampled to `sample_rate` one
+    window at a time, so at most `batch_size` windows are held in memory at once.
+    """
+
+    info = audio_info(vocal_path)
+    num_samples = info.num_frames * sample_rate // info.sample_rate
+    plan = plan_windows(num_samples, sample_rate, window_s, overlap_s)
+    stitcher = EmissionStitcher(plan)
+
+    windows = (
+        (index, load_window(vocal_path, start, plan.length, info.sample_rate, sample_rate))
+        for index, start in enumerate(plan.starts)
+    )
+    for index, emission in infer_windows(model, windows, batch_size, device, dtype):
+        yield stitcher.add(index, emission)
+
+def compute_emission(model, vocal_path, sample_rate, window_s=WINDOW_S, overlap_s=OVERLAP_S, batch_size=1, device=DEVICE, dtype=torch.float32):
+    return torch.cat(list(stream_emissions(model, vocal_path, sample_rate, window_s, overlap_s, batch_size, device, dtype)))
+
+def clean_transcript(transcript):
     transcript_cleaned = transcript.strip().replace("\n", " ").upper()
-    transcript_cleaned = ''.join(filter(lambda chr: chr.isalpha() or chr == " ", transcript_cleaned)).replace(" ", "|")
-
-    #load model
-    bundle = torchaudio.pipelines.WAV2VEC2_ASR_BASE_960H
-    model = bundle.get_model().to(DEVICE)
-    labels = bundle.get_labels()
-
-    # load audio
-    waveform, srate = torchaudio.load(vocal_path)
-    w_len = waveform.shape[1]
-    chunk_len = int(math.ceil(w_len/CHUNKS))
-    waveforms = [waveform[0, i:min(w_len,i+chunk_len)].unsqueeze(0) for i in range(CHUNKS)]
-    
-    emissions_list = []
-    with torch.inference_mode():
-        for i in range(CHUNKS):
-            emission, _ = model(waveforms[i].to(device))
-            emissions_list.append(torch.log_softmax(emission, dim=-1))
-    
-    emissions = torch.cat(emissions_list, 0)
-    emission = emissions[0].cpu().detach()
-    
+    return ''.join(filter(lambda chr: chr.isalpha() or chr == " ", transcript_cleaned)).replace(" ", "|")
+
+@profiled("aligner.align_emission")
+def align_emission(emission, transcript, labels, sample_rate, band_width=None, coarse_factor=None, hierarchical=False, executor=None):
+    """
+    Align the lyrics `transcript` to the `emission` of a waveform at `sample_rate`,
+    returning the aligned lines.
+
+    With `hierarchical`, the song is split at confident line breaks and the parts are
+    aligned independently, on `executor` if one is given (see `hierarchical_path`).
+    """
+
+    transcript_lines = transcript.split("\n")
+    transcript_cleaned = clean_transcript(transcript)
+
     dictionary = {c: i for i, c in enumerate(labels)}
     tokens = [dictionary[c] for c in transcript_cleaned]
 
-    trellis = get_trellis(emission, tokens) 
-    path = backtrack(trellis, emission, tokens)
+    if hierarchical:
+        # imported here, as the hierarchical module is built on top of this one
+        from .hierarchical import hierarchical_path
+        path = hierarchical_path(emission, tokens, transcript, executor, band_width, coarse_factor)
+    else:
+        path = get_path(emission, tokens, band_width, coarse_factor)
+
+    segments = merge_repeats_arrays(path)
+    word_segments = merge_words_arrays(segments, transcript_cleaned)
+    return merge_emission_lines(word_segments, transcript_lines, sample_rate)
 
-    segments = merge_repeats(path)
-    word_segments = merge_words(segments)
-    merged_lines = merge_lines(word_segments, transcript_lines, waveform.shape[1])
+def _align_job(emission, transcript, labels, sample_rate, outfile_path, band_width, coarse_factor, hierarchical=False, executor=None):
+    merged_lines = align_emission(
+        emission, transcript, labels, sample_rate, band_width, coarse_factor, hierarchical, executor
+    )
 
     with open(outfile_path, 'w') as f:
         export_transcript(merged_lines, f)
+    return merged_lines
+
+def _init_worker():
+    # workers run side by side, so each one gets a single thread
+    torch.set_num_threads(1)
+
+@dataclass
+class AlignmentJob:
+    vocal_path: str
+    lyrics_path: str
+    outfile_path: str
+
+PRECISIONS = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "qint8": torch.float32,
+}
+
+class Aligner:
+    """
+    Forced aligner that loads its acoustic model once and keeps it between songs.
+    """
+
+    def __init__(
+        self,
+        bundle="WAV2VEC2_ASR_BASE_960H",
+        device=DEVICE,
+        precision="float32",
+        window_s=WINDOW_S,
+        overlap_s=OVERLAP_S,
+        batch_size=1,
+        band_width=None,
+        coarse_factor=None,
+        workers=0,
+        cache=None,
+        hierarchical=False,
+    ):
+        """
+        `bundle` names a `torchaudio.pipelines` ASR bundle. `precision` is one of
+        `PRECISIONS`; `"qint8"` dynamically quantizes the model's linear layers and only
+        runs on the CPU. `workers` is the number of processes `align_many` aligns finished
+        emissions on; with `0`, they are aligned in this process.
+
+        If an `EmissionCache` is given as `cache`, emissions are looked up there before
+        running the model, and the model is only loaded once one is missing.
+
+        With `hierarchical`, songs are split at confident line breaks and the parts are
+        aligned independently. `align` solves the parts of its song on the worker pool;
+        `align_many` already spreads songs over the pool, so each worker solves the parts
+        of its song one after the other.
+        """
+
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown precision "{precision}"')
+        if precision == "qint8" and torch.device(device).type != "cpu":
+            raise ValueError("Quantized models only run on the CPU")
+
+        self.bundle_name = bundle
+        self.device = device
+        self.precision = precision
+        self.window_s = window_s
+        self.overlap_s = overlap_s
+        self.batch_size = batch_size
+        self.band_width = band_width
+        self.coarse_factor = coarse_factor
+        self.workers = workers
+        self.cache = cache
+        self.hierarchical = hierarchical
+
+        self._bundle = getattr(torchaudio.pipelines, bundle)
+        self.sample_rate = self._bundle.sample_rate
+        self.labels = self._bundle.get_labels()
+        self._model = None
+        self._executor = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with stage("aligner.load_model"):
+                model = self._bundle.get_model().eval()
+                if self.precision == "qint8":
+                    self._model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                else:
+                    self._model = model.to(self.device, PRECISIONS[self.precision])
+        return self._model
+
+    def _get_executor(self):
+        if self.workers and self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _cache_key(self, vocal_path):
+        return EmissionCache.key(
+            hash_audio(vocal_path),
+            bundle=self.bundle_name,
+            precision=self.precision,
+            window_s=self.window_s,
+            overlap_s=self.overlap_s,
+        )
+
+    def emission(self, vocal_path):
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(vocal_path)
+            emission = self.cache.get(key)
+            if emission is not None:
+                return emission
+
+        emission = compute_emission(
+            self.model,
+            vocal_path,
+            self.sample_rate,
+            self.window_s,
+            self.overlap_s,
+            self.batch_size,
+            self.device,
+            PRECISIONS[self.precision],
+        )
+
+        if key is not None:
+            self.cache.put(key, emission)
+        return emission
+
+    def align(self, vocal_path, lyrics_path, outfile_path):
+        with open(lyrics_path, 'r') as f:
+            transcript = f.read()
+
+        return _align_job(
+            self.emission(vocal_path),
+            transcript,
+            self.labels,
+            self.sample_rate,
+            outfile_path,
+            self.band_width,
+            self.coarse_factor,
+            self.hierarchical,
+            self._get_executor(),
+        )
+
+    def align_many(self, jobs):
+        """
+        Align every `AlignmentJob` in `jobs`, writing their transcripts and returning their
+        lines in the same order.
+
+        The windows of all songs go through the model together, in batches of
+        `batch_size`. Songs are processed from shortest to longest, so songs short enough
+        for a single window are batched with songs of similar length. As soon as the last
+        window of a song is inferred, its emission is aligned on the worker pool while
+        inference continues with the next batches.
+        """
+
+        jobs = list(jobs)
+        infos = [audio_info(job.vocal_path) for job in jobs]
+        order = sorted(range(len(jobs)), key=lambda i: infos[i].num_frames / infos[i].sample_rate)
+        dtype = PRECISIONS[self.precision]
+        executor = self._get_executor()
+
+        results = {}
+        def submit(i, emission):
+            with open(jobs[i].lyrics_path, 'r') as f:
+                transcript = f.read()
+
+            args = (
+                emission,
+                transcript,
+                self.labels,
+                self.sample_rate,
+                jobs[i].outfile_path,
+                self.band_width,
+                self.coarse_factor,
+                self.hierarchical,
+            )
+            results[i] = executor.submit(_align_job, *args) if executor else _align_job(*args)
+
+        # cached emissions skip the model entirely
+        keys = {}
+        if self.cache is not None:
+            for i in list(order):
+                keys[i] = self._cache_key(jobs[i].vocal_path)
+                emission = self.cache.get(keys[i])
+                if emission is not None:
+                    order.remove(i)
+                    submit(i, emission)
+
+        plans = {}
+        def windows():
+            for i in order:
+                info = infos[i]
+                plan = plan_windows(
+                    info.num_frames * self.sample_rate // info.sample_rate,
+                    self.sample_rate,
+                    self.window_s,
+                    self.overlap_s,
+                )
+                plans[i] = (plan, EmissionStitcher(plan), [])
+
+                for index, start in enumerate(plan.starts):
+                    window = load_window(jobs[i].vocal_path, start, plan.length, info.sample_rate, self.sample_rate)
+                    yield (i, index), window
+
+        model = self.model if order else None
+        for (i, index), emission in infer_windows(model, windows(), self.batch_size, self.device, dtype):
+            plan, stitcher, pieces = plans[i]
+            pieces.append(stitcher.add(index, emission))
+            if index < len(plan.starts) - 1:
+                continue
+
+            del plans[i]
+            emission = torch.cat(pieces)
+            if i in keys:
+                self.cache.put(keys[i], emission)
+            submit(i, emission)
+
+        if executor:
+            return [results[i].result() for i in range(len(jobs))]
+        return [results[i] for i in range(len(jobs))]
+
+def align(vocal_path, lyrics_path, outfile_path, band_width=None, coarse_factor=None, window_s=WINDOW_S, overlap_s=OVERLAP_S, batch_size=1, cache=None):
+    aligner = Aligner(
+        cache=cache,
+        window_s=window_s,
+        overlap_s=overlap_s,
+        batch_size=batch_size,
+        band_width=band_width,
+        coarse_factor=coarse_factor,
+    )
+    aligner.align(vocal_path, lyrics_path, outfile_path)
 
 if __name__ == "__main__":
     audiopath = sys.argv[1]
     if audiopath == '-h':
-        print("syntax: path/to/vocal.wav path/to/transcript.txt output/path.json")
+        print("syntax: python -m lync.aligner path/to/vocal.wav path/to/transcript.txt output/path.json")
     lyricpath = sys.argv[2]
-    outpath = sys.arv[3]
+    outpath = sys.argv[3]
 
     align(audiopath, lyricpath, outpath)
\ No newline at end of file
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Optional, Union
+import numpy as np
+import torch
+
+CACHE_DIR = "./.cache/emissions"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+# temporary files older than this were left behind by a writer that crashed
+STALE_TMP_SECONDS = 3600
+
+
+def hash_audio(source: Union[str, BinaryIO], chunk_size: int = 1 << 20) -> str:
+    """
+    Return the SHA-256 digest of the contents of the audio file (or binary file object)
+    `source`.
+    """
+
+    digest = hashlib.sha256()
+
+    if isinstance(source, str):
+        with open(source, "rb") as fl:
+            while chunk := fl.read(chunk_size):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        while chunk := source.read(chunk_size):
+            digest.update(chunk)
+        source.seek(0)
+
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class EmissionCache:
+    """
+    On-disk cache of emission matrices, keyed by the content of the audio together with the
+    parameters they were computed with.
+
+    Entries are stored as `.npy` files and read back memory-mapped. They are written to a
+    temporary file and renamed into place, so several processes on one host can share a
+    cache directory: readers only ever see complete entries, and a reader that loses an
+    entry to another process' eviction sees a miss. Once the directory grows beyond
+    `max_bytes`, the least recently used entries are evicted.
+    """
+
+    directory: str
+    max_bytes: int
+    stats: CacheStats
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(audio_hash: str, **params: Any) -> str:
+        """
+        Return the cache key of the emission of the audio with digest `audio_hash`, computed
+        with `params` (model bundle, precision, windowing, ...).
+        """
+
+        description = json.dumps({"audio": audio_hash, **params}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """
+        Return the cached emission for `key`, or `None` if there is none.
+        """
+
+        path = self._path(key)
+
+        try:
+            # copy-on-write, so the tensor is writable without touching the file
+            array = np.load(path, mmap_mode="c")
+            # the modification time doubles as the time of last use
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return torch.from_numpy(array)
+
+    def put(self, key: str, emission: torch.Tensor) -> None:
+        """
+        Store `emission` under `key`, evicting old entries if the cache grew too large.
+        """
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as fl:
+                np.save(fl, emission.detach().cpu().numpy())
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self._evict()
+
+    def _evict(self) -> None:
+        entries: list[tuple[float, int, str]] = []
+        now = time.time()
+
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                continue
+
+            if entry.name.endswith(".npy"):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith(".tmp") and now - stat.st_mtime > STALE_TMP_SECONDS:
+                self._remove(entry.path)
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            if self._remove(path):
+                self.stats.evictions += 1
+            total -= size
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
@@ -4,6 +4,7 @@ import math
 from typing import Any, TypeVar, Generic, Optional
 from dataclasses import dataclass
 from enum import Enum
+from ..profiling import count, stage
 
 
 def url_join(base: str, *components: str) -> str:
@@ -116,17 +117,21 @@ class APIInterface:
     def get(self, endpoint: str, query_params: dict[str, Any] = {}) -> APIResponse:
 
         url = url_join(self._api_root, endpoint)
+        count("api.requests")
 
-        return self._build_response(
-            self._session.get(url, headers=self._build_headers(), params=query_params)
-        )
+        with stage("api.get"):
+            return self._build_response(
+                self._session.get(url, headers=self._build_headers(), params=query_params)
+            )
 
     def post(self, endpoint: str, body: Optional[str] = None) -> APIResponse:
         url = url_join(self._api_root, endpoint)
+        count("api.requests")
 
-        return self._build_response(
-            self._session.post(url, headers=self._build_headers(), data=body)
-        )
+        with stage("api.post"):
+            return self._build_response(
+                self._session.post(url, headers=self._build_headers(), data=body)
+            )
 
     def _build_headers(self) -> dict[str, str]:
         """
@@ -0,0 +1,258 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Callable, Mapping, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from .api import APIResponse, APIErrorData, APIErrorCode, url_join
+from ..profiling import count, stage
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 10.0
+DEFAULT_RETRIES = 3
+BACKOFF_SECONDS = 0.5
+# after being slowed down, a host's rate grows back to the initial rate within this time
+RECOVERY_SECONDS = 10.0
+
+ResponseBuilder = Callable[[int, Mapping[str, str], bytes], APIResponse]
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter refilling at `rate` tokens per second, holding at most
+    `capacity` tokens.
+
+    The rate adapts to the server: `penalize` halves it (down to `min_rate`) and pauses all
+    requests for a while, and `reward` raises it again linearly over time, by the initial
+    rate every `recovery_s` seconds. A burst of rate limited requests halves the rate once:
+    requests started before the last penalty, or rejected within its Retry-After or round
+    trip time, only extend the pause.
+    """
+
+    rate: float
+    max_rate: float
+    min_rate: float
+    capacity: float
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        min_rate: float = 0.1,
+        recovery_s: float = RECOVERY_SECONDS,
+    ) -> None:
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.recovery_s = recovery_s
+
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._last_adjusted = self._last_refill
+        self._paused_until = 0.0
+        self._last_penalty = -float("inf")
+        self._quiet_until = -float("inf")
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+
+        # waiters queue up on the lock, so tokens are handed out in order
+        async with self._lock:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, retry_after: Optional[float] = None, started_at: Optional[float] = None) -> None:
+        """
+        React to a rate limited request that was sent at `started_at` (by `time.monotonic`),
+        pausing for `retry_after` seconds if given.
+        """
+
+        now = time.monotonic()
+        started_at = now if started_at is None else started_at
+        self._tokens = 0
+
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+        # requests sent before the last penalty were paced at the old rate
+        if started_at < self._last_penalty or now < self._quiet_until:
+            return
+
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._last_penalty = self._last_adjusted = now
+        self._quiet_until = now + max(retry_after or 0.0, now - started_at)
+
+    def reward(self) -> None:
+        """
+        React to a successful request.
+        """
+
+        now = time.monotonic()
+        # the rate does not recover while requests are paused
+        elapsed = now - max(self._last_adjusted, self._paused_until)
+        self._last_adjusted = now
+
+        if elapsed > 0:
+            self.rate = min(self.max_rate, self.rate + elapsed * self.max_rate / self.recovery_s)
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class AsyncAPIInterface:
+    """
+    asyncio counterpart of `APIInterface`.
+
+    All requests reuse the connections of one `aiohttp.ClientSession`. Requests to each host
+    are limited to `max_concurrency` at a time and paced by a `TokenBucket` of `rate`
+    requests per second that slows down whenever the host rate limits a request. Rate
+    limited requests, server errors and connection errors are retried up to `retries` times
+    with exponential backoff.
+    """
+
+    _api_root: str
+    _session: aiohttp.ClientSession
+
+    def __init__(
+        self,
+        api_root: str,
+        session: aiohttp.ClientSession,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        rate: float = DEFAULT_RATE,
+        retries: int = DEFAULT_RETRIES,
+    ) -> None:
+        self._api_root = api_root
+        self._session = session
+        self._max_concurrency = max_concurrency
+        self._rate = rate
+        self._retries = retries
+        self._hosts: dict[str, tuple[asyncio.Semaphore, TokenBucket]] = {}
+
+    def get_api_root(self) -> str:
+        return self._api_root
+
+    def _host_limits(self, url: str) -> tuple[asyncio.Semaphore, TokenBucket]:
+        host = urlsplit(url).netloc
+
+        if host not in self._hosts:
+            self._hosts[host] = (asyncio.Semaphore(self._max_concurrency), TokenBucket(self._rate))
+
+        return self._hosts[host]
+
+    async def get(self, endpoint: str, query_params: dict[str, Any] = {}) -> APIResponse:
+        url = url_join(self._api_root, endpoint)
+
+        return await self._request("GET", url, self._build_response, params=query_params)
+
+    async def post(self, endpoint: str, body: Optional[str] = None) -> APIResponse:
+        url = url_join(self._api_root, endpoint)
+
+        return await self._request("POST", url, self._build_response, data=body)
+
+    async def get_page(self, url: str) -> APIResponse[str]:
+        """
+        Fetch the HTML page at the absolute URL `url`, subject to the same limits as API
+        requests to its host.
+        """
+
+        return await self._request("GET", url, self._build_page_response)
+
+    async def _request(self, method: str, url: str, build: ResponseBuilder, **kwargs: Any) -> APIResponse:
+        semaphore, bucket = self._host_limits(url)
+
+        for attempt in range(self._retries + 1):
+            await bucket.acquire()
+            retry_after = None
+            count("api.requests")
+
+            async with semaphore:
+                started_at = time.monotonic()
+                try:
+                    with stage("api.async_request"):
+                        async with self._session.request(
+                            method, url, headers=self._build_headers(), **kwargs
+                        ) as response:
+                            body = await response.read()
+
+                        if response.status == 429:
+                            retry_after = _retry_after(response.headers)
+                            result = APIResponse.Error(APIErrorData(APIErrorCode.RateLimited, body))
+                        elif response.status >= 500:
+                            result = APIResponse.Error(APIErrorData(APIErrorCode.Unknown, body))
+                        else:
+                            result = build(response.status, response.headers, body)
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    result = APIResponse.Error(APIErrorData(APIErrorCode.Unknown, str(error)))
+
+            if result.ok():
+                bucket.reward()
+                return result
+
+            code = result.get_error().code
+
+            if code == APIErrorCode.RateLimited:
+                count("api.rate_limited")
+                bucket.penalize(retry_after, started_at)
+            elif code != APIErrorCode.Unknown:
+                # the request itself is at fault; retrying will not help
+                return result
+
+            if attempt < self._retries:
+                count("api.retries")
+                await asyncio.sleep(BACKOFF_SECONDS * 2**attempt)
+
+        return result
+
+    def _build_headers(self) -> dict[str, str]:
+        """
+        Overridable method implementing construction of a header object that should be
+        included in every request. This is for inclusion of parameters such as
+        authorization tokens and/or API keys.
+        """
+
+        return {"Accept": "application/json"}
+
+    def _build_response(self, status: int, headers: Mapping[str, str], body: bytes) -> APIResponse:
+        """
+        Abstract method that should appropriately construct an `APIResponse` object from the
+        status, headers and body of a response.
+        """
+
+        raise NotImplementedError()
+
+    def _build_page_response(self, status: int, headers: Mapping[str, str], body: bytes) -> APIResponse:
+        if status in (401, 403):
+            return APIResponse.Error(APIErrorData(APIErrorCode.PermissionDenied, status))
+        if status >= 400:
+            return APIResponse.Error(APIErrorData(APIErrorCode.MalformedRequest, status))
+
+        content_type = headers.get("Content-Type", "")
+
+        if "text/html" not in content_type:
+            return APIResponse.Error(APIErrorData(APIErrorCode.MalformedResponse, content_type))
+
+        return APIResponse.Success(body.decode("utf-8", errors="replace"))
@@ -4,6 +4,7 @@ import math
 from requests_cache import CachedSession
 from requests_cache.backends.filesystem import FileCache
 from ..api import APIInterface, APIResponse, APIErrorData, APIErrorCode
+from ...profiling import profiled
 from .models import Lyrics, GeniusSearchResult
 from .lyrics import fetch_lyrics
 from .exceptions import GeniusAPIError
@@ -11,30 +12,38 @@ from .exceptions import GeniusAPIError
 GENIUS_API_ROOT = "https://genius.com/api"
 ACHE_FOREVER = math.inf
 
-class GeniusInterface(APIInterface):
-    def _build_response(self, request_response: requests.Response) -> APIResponse:
-        try:
-            data = request_response.json()
+def parse_genius_payload(data: Any, content: bytes) -> APIResponse:
+    """
+    Construct an `APIResponse` from the decoded JSON body `data` of a response from the
+    Genius API, where `content` is the raw body.
+    """
+
+    try:
+        meta = data["meta"]
+
+        if meta["status"] != 200:
+            return APIResponse.Error(
+                APIErrorData(APIErrorCode.MalformedResponse, meta.get("message"))
+            )
+
+        return APIResponse.Success(data.get("response"))
 
-            meta = data["meta"]
+    except KeyError:
+        # In case of missing fields that were expected in the response, such as "meta"
 
-            if meta["status"] != 200:
-                return APIResponse.Error(
-                    APIErrorData(APIErrorCode.MalformedResponse, meta.get("message"))
-                )
+        return APIResponse.Error(APIErrorData(APIErrorCode.MalformedResponse, content))
 
-            return APIResponse.Success(data.get("response"))
 
+class GeniusInterface(APIInterface):
+    def _build_response(self, request_response: requests.Response) -> APIResponse:
+        try:
+            data = request_response.json()
         except requests.exceptions.JSONDecodeError:
             return APIResponse.Error(
                 APIErrorData(APIErrorCode.MalformedResponse, request_response.content)
             )
-        except KeyError:
-            # In case of missing fields that were expected in the response, such as "meta"
 
-            return APIResponse.Error(
-                APIErrorData(APIErrorCode.MalformedResponse, request_response.content)
-            )
+        return parse_genius_payload(data, request_response.content)
 
 
 def associate_array(data: list[dict], key_name: str, allow_duplicates=False) -> dict[str, Any]:
@@ -74,6 +83,36 @@ def associate_array(data: list[dict], key_name: str, allow_duplicates=False) ->
     return out
 
 
+SEARCH_PARAMS = {"per_page": 4}
+
+
+def parse_search_result(data: dict) -> Optional[GeniusSearchResult]:
+    """
+    Return the song with most page views in the data of a response to a `/search/multi`
+    request, or `None` if there are no songs in it.
+    """
+
+    sections = associate_array(data["sections"], "type")
+
+    song = sections.get("song")
+
+    if not song or not song["hits"]:
+        return None
+
+    hits = song["hits"]
+
+    # return result with most pageviews
+    get_pageviews = lambda hit: hit["result"]["stats"].get("pageviews", 0)
+    song_result = max(hits, key=get_pageviews)["result"]
+
+    return GeniusSearchResult(
+        title=song_result["title"],
+        artist_name=song_result["artist_names"],
+        lyrics_url=song_result["url"],
+        song_image_url=song_result["song_art_image_url"]
+    )
+
+
 class Genius:
     """
     API Wrapper for the internal Genius API (http://genius.com/api)
@@ -109,8 +148,9 @@ class Genius:
         """
 
         if not response.ok():
-            raise GeniusAPIError(f"API call failed; error: " + response.get_error().data)
+            raise GeniusAPIError(f"API call failed; error: {response.get_error().data}")
 
+    @profiled("genius.search")
     def search(self, query: str) -> Optional[GeniusSearchResult]:
         """
         Search Genius for the song provided by `query`. Return the result with most page views.
@@ -121,30 +161,12 @@ class Genius:
         - `search("goosebumps travis scott")`
         """
 
-        response = self._api.get("/search/multi", {"per_page": 4, "q": query})
+        response = self._api.get("/search/multi", SEARCH_PARAMS | {"q": query})
         self._assert_ok(response)
 
-        data = response.get_data()
-        sections = associate_array(data["sections"], "type")
-
-        song = sections.get("song")
-
-        if not song or not song["hits"]:
-            return None
-
-        hits = song["hits"]
-
-        # return result with most pageviews
-        get_pageviews = lambda hit: hit["result"]["stats"].get("pageviews", 0)
-        song_result = max(hits, key=get_pageviews)["result"]
-
-        return GeniusSearchResult(
-            title=song_result["title"],
-            artist_name=song_result["artist_names"],
-            lyrics_url=song_result["url"],
-            song_image_url=song_result["song_art_image_url"]
-        )
+        return parse_search_result(response.get_data())
 
+    @profiled("genius.get_lyrics")
     def get_lyrics(self, song: GeniusSearchResult) -> Lyrics:
         """
         Extract the lyric data from the page referenced by the provided search result `song`.
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import asyncio
+import json
+from typing import Iterable, Mapping, Optional, Union
+import aiohttp
+from ..api import APIResponse, APIErrorData, APIErrorCode
+from ..async_api import AsyncAPIInterface, DEFAULT_CONCURRENCY, DEFAULT_RATE
+from . import GENIUS_API_ROOT, SEARCH_PARAMS, parse_genius_payload, parse_search_result
+from .models import Lyrics, GeniusSearchResult
+from .lyrics import parse_lyrics_page
+from .exceptions import GeniusAPIError, GeniusLyricsFetchError
+
+
+class AsyncGeniusInterface(AsyncAPIInterface):
+    def _build_response(self, status: int, headers: Mapping[str, str], body: bytes) -> APIResponse:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return APIResponse.Error(APIErrorData(APIErrorCode.MalformedResponse, body))
+
+        return parse_genius_payload(data, body)
+
+
+class AsyncGenius:
+    """
+    asyncio counterpart of `Genius`, for resolving many songs concurrently. Use as an async
+    context manager, which owns the underlying HTTP session:
+    ```
+    async with AsyncGenius() as genius:
+        songs = await genius.search_many(["drake - one dance", "starboy"])
+    ```
+    """
+
+    _api: AsyncGeniusInterface
+    _session: aiohttp.ClientSession
+
+    def __init__(
+        self,
+        api_root: str = GENIUS_API_ROOT,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        rate: float = DEFAULT_RATE,
+    ) -> None:
+        """
+        At most `max_concurrency` requests are in flight, and at most `rate` are started per
+        second, per host. `api_root` can point to a local server for testing.
+        """
+
+        self._api_root = api_root
+        self._max_concurrency = max_concurrency
+        self._rate = rate
+
+    async def __aenter__(self) -> AsyncGenius:
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self._max_concurrency)
+        )
+        self._api = AsyncGeniusInterface(
+            self._api_root, self._session, self._max_concurrency, self._rate
+        )
+
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self._session.close()
+
+    def _assert_ok(self, response: APIResponse) -> None:
+        if not response.ok():
+            raise GeniusAPIError(f"API call failed; error: {response.get_error().data}")
+
+    async def search(self, query: str) -> Optional[GeniusSearchResult]:
+        """
+        Search Genius for the song provided by `query`. Return the result with most page views.
+        """
+
+        response = await self._api.get("/search/multi", SEARCH_PARAMS | {"q": query})
+        self._assert_ok(response)
+
+        return parse_search_result(response.get_data())
+
+    async def get_lyrics(self, song: GeniusSearchResult) -> Lyrics:
+        """
+        Extract the lyric data from the page referenced by the provided search result `song`.
+        """
+
+        response = await self._api.get_page(song.lyrics_url)
+
+        if not response.ok():
+            raise GeniusLyricsFetchError(f"HTTP request failed; {response.get_error().data}")
+
+        return parse_lyrics_page(response.get_data())
+
+    async def search_many(
+        self, queries: Iterable[str], return_exceptions: bool = False
+    ) -> list[Union[Optional[GeniusSearchResult], BaseException]]:
+        """
+        `search` every query in `queries` concurrently, returning the results in order. With
+        `return_exceptions`, failed searches return their exception instead of raising it.
+        """
+
+        return await asyncio.gather(
+            *(self.search(query) for query in queries), return_exceptions=return_exceptions
+        )
+
+    async def get_lyrics_many(
+        self, songs: Iterable[GeniusSearchResult], return_exceptions: bool = False
+    ) -> list[Union[Lyrics, BaseException]]:
+        """
+        `get_lyrics` for every song in `songs` concurrently, returning the lyrics in order.
+        With `return_exceptions`, failures return their exception instead of raising it.
+        """
+
+        return await asyncio.gather(
+            *(self.get_lyrics(song) for song in songs), return_exceptions=return_exceptions
+        )
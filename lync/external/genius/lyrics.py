@@ -1,10 +1,10 @@
 import re
 import requests
 import json
-from ast import literal_eval
-from typing import Optional, Union
+from typing import Any, Optional, Union
 from .models import Lyrics, Section, Line, GeniusSearchResult
 from .exceptions import GeniusLyricsFetchError
+from ...profiling import profiled
 
 
 def fetch_lyrics(song: GeniusSearchResult, session: requests.Session) -> Lyrics:
@@ -17,16 +17,23 @@ def fetch_lyrics(song: GeniusSearchResult, session: requests.Session) -> Lyrics:
     # validate status and response type of request
 
     if not response.ok:
-        GeniusLyricsFetchError(f"HTTP request failed; {response.status_code}")
+        raise GeniusLyricsFetchError(f"HTTP request failed; {response.status_code}")
 
     response_type = response.headers.get("content-type")
 
     if not response_type or "text/html" not in response_type:
         raise GeniusLyricsFetchError("Invalid response type; expected HTML")
 
-    # extract, parse, and transform data
+    return parse_lyrics_page(response.text)
 
-    lyrics_data = extract_lyrics_data(response.text)
+
+@profiled("genius.parse_lyrics_page")
+def parse_lyrics_page(html_content: str) -> Lyrics:
+    """
+    Extract the lyrics from the HTML source of a song lyrics page.
+    """
+
+    lyrics_data = extract_lyrics_data(html_content)
 
     if not lyrics_data:
         raise GeniusLyricsFetchError("Embedded lyric data not found")
@@ -34,25 +41,169 @@ def fetch_lyrics(song: GeniusSearchResult, session: requests.Session) -> Lyrics:
     return reformat_lyrics_data(lyrics_data)
 
 
+STATE_PREFIX = "window.__PRELOADED_STATE__ = JSON.parse("
+# the key of the lyrics in the embedded state, with its quotes possibly escaped
+LYRICS_KEY_PATTERN = re.compile(r'\\?"lyricsData\\?"\s*:')
+
+# escape sequences of a JS string literal; unknown escapes stand for the escaped character
+ESCAPE_PATTERN = re.compile(r"\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)", re.DOTALL)
+SIMPLE_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v", "0": "\0", "\n": ""}
+# length of the longest escape sequence, `\u{10FFFF}`
+MAX_ESCAPE_LENGTH = 10
+
+INITIAL_CHUNK_SIZE = 64 * 1024
+
+
+def find_state_literal(html_content: str) -> Optional[str]:
+    """
+    Return the (still escaped) contents of the JS string literal holding the embedded page
+    state, or `None` if the page has none.
+    """
+
+    start = html_content.find(STATE_PREFIX)
+
+    if start == -1:
+        return None
+
+    start += len(STATE_PREFIX)
+    quote = html_content[start:start + 1]
+
+    if quote not in ("'", '"'):
+        return None
+
+    position = start + 1
+
+    while (end := html_content.find(quote, position)) != -1:
+        # the literal ends at the first quote not preceded by an odd number of backslashes
+        backslash = end
+
+        while html_content[backslash - 1] == "\\":
+            backslash -= 1
+
+        if (end - backslash) % 2 == 0:
+            return html_content[start + 1:end]
+
+        position = end + 1
+
+    return None
+
+
+def _unescape(match: re.Match) -> str:
+    escape = match.group(1)
+
+    if escape[0] in "ux" and len(escape) > 1:
+        return chr(int(escape[1:].strip("{}"), 16))
+
+    return SIMPLE_ESCAPES.get(escape, escape)
+
+
+def unescape_js(literal: str) -> str:
+    """
+    Decode the escape sequences in the contents of a JS string literal.
+    """
+
+    return ESCAPE_PATTERN.sub(_unescape, literal)
+
+
+def _chunk_end(literal: str, end: int) -> int:
+    """
+    Return the first position from `end` on that does not split an escape sequence of
+    `literal`, i.e. is preceded by enough characters without a backslash.
+    """
+
+    while end < len(literal):
+        backslash = literal.rfind("\\", end - MAX_ESCAPE_LENGTH, end)
+
+        if backslash == -1:
+            return end
+
+        end = backslash + MAX_ESCAPE_LENGTH + 1
+
+    return len(literal)
+
+
+def _decode_value(decoder: json.JSONDecoder, literal: str, start: int) -> Any:
+    """
+    Decode the JSON value starting at `start` in the string literal `literal`, returning
+    `None` if it does not parse.
+    """
+
+    size = INITIAL_CHUNK_SIZE
+
+    while True:
+        end = _chunk_end(literal, start + size)
+
+        try:
+            value, _ = decoder.raw_decode(unescape_js(literal[start:end]).lstrip())
+            return value
+        except json.JSONDecodeError:
+            # the chunk ended inside the value
+            if end == len(literal):
+                return None
+
+            size *= 4
+
+
 def extract_lyrics_data(html_content: str) -> Optional[dict]:
     """
     The HTML source of a song lyrics page contains embedded JSON data that describes the
-    content of the page, including the page's lyrics. Extract and return all parsed
-    JSON data from the page.
-    """
+    content of the page, including the page's lyrics. Extract and return the parsed
+    `lyricsData` object from it.
 
-    DATA_REGEX_PATTERN = r"(?<=window\.__PRELOADED_STATE__ = JSON\.parse\()(['\"])(.|\n)+?\1(?=\))"
+    Only the part of the embedded data from the lyrics on is decoded, in chunks of growing
+    size, until the lyrics object parses; the rest of the data is never parsed.
+    """
 
-    match = re.search(DATA_REGEX_PATTERN, html_content)
+    literal = find_state_literal(html_content)
 
-    if match is None:
+    if literal is None:
         return None
 
-    # unescape dollar signs, as they produce invalid JSON
-    json_string = literal_eval(match.group()).replace("\\$", "$")
-    json_data = json.loads(json_string)
+    decoder = json.JSONDecoder()
+
+    # other parts of the state may hold a `lyricsData` key too; the lyrics are the object
+    # with a `body`
+    for key_match in LYRICS_KEY_PATTERN.finditer(literal):
+        lyrics_data = _decode_value(decoder, literal, key_match.end())
 
-    return json_data
+        if isinstance(lyrics_data, dict) and "body" in lyrics_data:
+            return lyrics_data
+
+    return None
+
+
+def inner_text(node: Union[dict, str]) -> str:
+    """
+    `children` is a list of nodes, where each node is either
+    an object of the form
+    ```
+    Node {
+        tag: string;
+        children: Node[];
+    }
+    ```
+    or a string representing encapsulated text.
+
+    Return the entire encapsulated text of a node, concatenating the text of child nodes.
+    - Nodes with tag `"br"` will be represented as a newline character.
+    - Nodes with no `children` property will be represented as an empty string.
+    """
+
+    pieces: list[str] = []
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, str):
+            pieces.append(node)
+        elif node.get("tag") == "br":
+            pieces.append("\n")
+        elif node.get("children"):
+            # pushed in reverse, so that the first child is visited first
+            stack.extend(reversed(node["children"]))
+
+    return "".join(pieces)
 
 
 def reformat_lyrics_data(lyrics_data: dict) -> Lyrics:
@@ -64,37 +215,8 @@ def reformat_lyrics_data(lyrics_data: dict) -> Lyrics:
     if not isinstance(lyrics_data, dict):
         raise GeniusLyricsFetchError()
 
-    children = lyrics_data["songPage"]["lyricsData"]["body"]["children"][0]
+    children = lyrics_data["body"]["children"][0]
     sections: list[Section] = []
-
-    def inner_text(child: Union[dict, str]) -> str:
-        """
-        `children` is a list of nodes, where each node is either
-        an object of the form
-        ```
-        Node {
-            tag: string;
-            children: Node[];
-        }
-        ```
-        or a string representing encapsulated text.
-
-        Return the entire encapsulated text of a node, concatenating the text of child nodes.
-        - Nodes with tag `"br"` will be represented as a newline character.
-        - Nodes with no `children` property will be represented as an empty string.  
-        """
-
-        if isinstance(child, str):
-            return child
-        
-        if child.get("tag") == "br":
-            return "\n"
-        
-        if not child.get("children"):
-            return ""
-
-        return "".join(inner_text(child_child) for child_child in child["children"])
-
     lines: list[Line] = []
 
     for line in inner_text(children).split("\n"):
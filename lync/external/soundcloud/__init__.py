@@ -1,16 +1,31 @@
-from typing import Optional
-from os import urandom, mkdir, remove
-from os.path import join, exists
+from typing import Any, Optional
+from os import urandom, makedirs, remove, replace
+from os.path import dirname, join
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+import io
+import shutil
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from pydub import AudioSegment
-from .client_id import obtain_client_id
+from .client_id import ClientIDCache, get_client_id, refresh_client_id
 from .exceptions import SoundcloudSearchException, SoundcloudAudioDLException
 from ..api import APIInterface, APIResponse, APIErrorData, APIErrorCode
+from ...profiling import profiled
 from .models import SoundCloudSearchResult, MediaTranscoding, Audio
 
 SOUNDCLOUD_API_ROOT = "https://api-v2.soundcloud.com"
 UA = "ozilla/5.0 (Macintosh; Intel Mac OS X 10_8_2) AppleWebKit/537.17 (KHTML, like Gecko) Chrome/24.0.1309.0 Safari/537.17"
 
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 30
+
+# MIME types of output formats whose playlist segments can be concatenated byte by byte
+BYTE_JOINABLE_FORMATS = {"mp3": "audio/mpeg"}
+
 
 def random_id() -> int:
     """
@@ -22,6 +37,12 @@ def random_id() -> int:
 
 class SoundcloudInterface(APIInterface):
     def _build_response(self, request_response: requests.Response) -> APIResponse:
+        if request_response.status_code in (401, 403):
+            # most likely an expired client ID
+            return APIResponse.Error(
+                APIErrorData(APIErrorCode.PermissionDenied, request_response.content)
+            )
+
         try:
             data = request_response.json()
 
@@ -39,6 +60,45 @@ class SoundcloudInterface(APIInterface):
         return headers
 
 
+def parse_search_result(data: dict) -> Optional[SoundCloudSearchResult]:
+    """
+    Return the top track in the data of a response to a `/search` request, or `None` if
+    there is no track with audio in it.
+    """
+
+    results: list = data["collection"]
+    # filter non-tracks
+    results = [item for item in results if item["kind"] == "track"]
+
+    if not results:
+        return None
+
+    # get top result
+    result = results[0]
+
+    media_transcoding_objects = result["media"]["transcodings"]
+    if not media_transcoding_objects:
+        return None
+
+    media_transcodings = [
+        MediaTranscoding(
+            url=transcoding["url"],
+            preset=transcoding["preset"],
+            duration=transcoding["duration"],
+            protocol=transcoding["format"]["protocol"],
+            mime=transcoding["format"]["mime_type"],
+        )
+        for transcoding in media_transcoding_objects
+    ]
+
+    return SoundCloudSearchResult(
+        title=result["title"],
+        artist_name=result["publisher_metadata"]["artist"],
+        song_image_url=result["artwork_url"],
+        stream_transcodings=media_transcodings,
+    )
+
+
 class Soundcloud:
     """
     API Wrapper for the internal Soundcloud API
@@ -46,13 +106,34 @@ class Soundcloud:
 
     _api: SoundcloudInterface
     _session: requests.Session
-    _client_id: str
+    _client_id: Optional[str]
+    _client_id_cache: Optional[ClientIDCache]
+
+    def __init__(self, client_id_cache: Optional[ClientIDCache] = ClientIDCache()) -> None:
+        """
+        The client ID is obtained on first use, and shared with other instances and processes
+        through `client_id_cache`. Pass `None` to always obtain a fresh one.
+        """
 
-    def __init__(self) -> None:
         self._session = requests.Session()
+        # keep a pooled connection for every concurrent segment download
+        adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
 
         self._api = SoundcloudInterface(SOUNDCLOUD_API_ROOT, self._session)
-        self._client_id = obtain_client_id(self._session)
+        self._client_id = None
+        self._client_id_cache = client_id_cache
+
+    @property
+    def client_id(self) -> str:
+        if self._client_id is None:
+            self._client_id = get_client_id(self._session, self._client_id_cache)
+
+        return self._client_id
+
+    def _refresh_client_id(self) -> None:
+        self._client_id = refresh_client_id(self._session, self._client_id, self._client_id_cache)
 
     def _assert_ok(self, response: APIResponse) -> None:
         """
@@ -61,47 +142,30 @@ class Soundcloud:
         """
 
         if not response.ok():
-            raise SoundcloudSearchException(f"API call failed; error: " + response.get_error().data)
+            raise SoundcloudSearchException(f"API call failed; error: {response.get_error().data}")
 
-    def search(self, query: str) -> Optional[SoundCloudSearchResult]:
-        response = self._api.get(
-            "/search", {"q": query, "facet": "model", "client_id": self._client_id}
-        )
-        self._assert_ok(response)
-        data = response.get_data()
+    def _get(self, endpoint: str, query_params: dict[str, Any]) -> APIResponse:
+        """
+        Make an API request with the client ID, obtaining a new client ID and retrying once if
+        it was rejected.
+        """
 
-        results: list = data["collection"]
-        # filter non-tracks
-        results = [item for item in results if item["kind"] == "track"]
+        response = self._api.get(endpoint, {**query_params, "client_id": self.client_id})
 
-        if not results:
-            return None
+        if not response.ok() and response.get_error().code == APIErrorCode.PermissionDenied:
+            self._refresh_client_id()
+            response = self._api.get(endpoint, {**query_params, "client_id": self.client_id})
 
-        # get top result
-        result = results[0]
+        return response
 
-        media_transcoding_objects = result["media"]["transcodings"]
-        if not media_transcoding_objects:
-            return None
+    @profiled("soundcloud.search")
+    def search(self, query: str) -> Optional[SoundCloudSearchResult]:
+        response = self._get("/search", {"q": query, "facet": "model"})
+        self._assert_ok(response)
 
-        media_transcodings = [
-            MediaTranscoding(
-                url=transcoding["url"],
-                preset=transcoding["preset"],
-                duration=transcoding["duration"],
-                protocol=transcoding["format"]["protocol"],
-                mime=transcoding["format"]["mime_type"],
-            )
-            for transcoding in media_transcoding_objects
-        ]
-
-        return SoundCloudSearchResult(
-            title=result["title"],
-            artist_name=result["publisher_metadata"]["artist"],
-            song_image_url=result["artwork_url"],
-            stream_transcodings=media_transcodings,
-        )
+        return parse_search_result(response.get_data())
 
+    @profiled("soundcloud.fetch_playlist")
     def _fetch_playlist_entries(self, transcoding: MediaTranscoding) -> list[str]:
         """
         Return a list of audio URLs representing the playlist file at the URL in the provided
@@ -109,8 +173,13 @@ class Soundcloud:
         """
 
         response = self._session.get(
-            transcoding.url, params={"client_id": self._client_id, "User-Agent": UA}
+            transcoding.url, params={"client_id": self.client_id, "User-Agent": UA}
         )
+        if response.status_code in (401, 403):
+            self._refresh_client_id()
+            response = self._session.get(
+                transcoding.url, params={"client_id": self.client_id, "User-Agent": UA}
+            )
         if not response.ok:
             raise SoundcloudAudioDLException(
                 "Transcoding request failed: " + str(response.status_code) + ": " + str(response.content)
@@ -122,43 +191,115 @@ class Soundcloud:
         lines = playlist_data.split("\n")
         return [line for line in lines if line.startswith("http")]  # return lines resembling URLs
 
-    def _download_playlist(self, transcoding: MediaTranscoding, output_dir: str) -> list[str]:
+    @profiled("soundcloud.download_segment")
+    def _download_segment(self, url: str, filename: str) -> None:
         """
-        Download audio files in the playlist provided by `transcoding`, returning corresponding
-        file paths to downloaded audio files in the same order as the playlist.
+        Stream the audio file at `url` to `filename`, retrying failed attempts with
+        exponential backoff.
         """
 
-        output_filenames: list[str] = []
-
-        if not exists(output_dir):
-            mkdir(output_dir)
-
-        for url in self._fetch_playlist_entries(transcoding):
-            response = self._session.get(url)
+        for attempt in range(DOWNLOAD_RETRIES):
+            try:
+                with self._session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+                    if response.ok:
+                        with open(filename, "wb") as fl:
+                            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                                fl.write(chunk)
+                        return
+
+                    # client errors other than rate limiting will not go away by retrying
+                    if response.status_code < 500 and response.status_code != 429:
+                        break
+            except requests.RequestException:
+                pass
+
+            if attempt < DOWNLOAD_RETRIES - 1:
+                time.sleep(0.5 * 2**attempt)
+
+        raise SoundcloudAudioDLException(f"Failed to download audio file at {url}")
+
+    def _download_playlist(
+        self, transcoding: MediaTranscoding, output_dir: str, workers: int = DOWNLOAD_WORKERS
+    ) -> list[str]:
+        """
+        Download audio files in the playlist provided by `transcoding`, returning corresponding
+        file paths to downloaded audio files in the same order as the playlist. Up to `workers`
+        files are downloaded at once.
+        """
 
-            if not response.ok:
-                raise SoundcloudAudioDLException(f"Failed to download audio file at {url}")
+        makedirs(output_dir, exist_ok=True)
 
-            identifier = random_id()
-            filename = join(output_dir, str(identifier) + ".audio")  # use generic file extension
-            output_filenames.append(filename)
+        urls = self._fetch_playlist_entries(transcoding)
+        # use generic file extension
+        output_filenames = [join(output_dir, f"{index:05d}.audio") for index in range(len(urls))]
 
-            with open(filename, "wb") as fl:
-                fl.write(response.content)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # consume the results to raise the first download error, if any
+            list(executor.map(self._download_segment, urls, output_filenames))
 
         return output_filenames
 
-    def download_audio(self, transcoding: MediaTranscoding, output: str) -> None:
+    @profiled("soundcloud.download_audio")
+    def _join_playlist(
+        self, transcoding: MediaTranscoding, output: io.IOBase, format: str, workers: int
+    ) -> None:
+        with TemporaryDirectory() as tmp_dir:
+            audio_files = self._download_playlist(transcoding, tmp_dir, workers)
+            if not audio_files:
+                raise SoundcloudAudioDLException("Playlist has no audio files")
+
+            if transcoding.mime.startswith(BYTE_JOINABLE_FORMATS.get(format, "-")):
+                # the segments are already in the requested format; no need to re-encode
+                for audio_file in audio_files:
+                    with open(audio_file, "rb") as fl:
+                        shutil.copyfileobj(fl, output)
+                return
+
+            audio_segments: list[AudioSegment] = [AudioSegment.from_file(f) for f in audio_files]
+
+        # join the decoded samples in one go rather than copying the audio for every segment
+        first = audio_segments[0]
+        combined = first._spawn(b"".join(
+            segment
+            .set_frame_rate(first.frame_rate)
+            .set_channels(first.channels)
+            .set_sample_width(first.sample_width)
+            .raw_data
+            for segment in audio_segments
+        ))
+
+        combined.export(output, format=format)
+
+    def download_audio(
+        self, transcoding: MediaTranscoding, output: str, format: str = "mp3", workers: int = DOWNLOAD_WORKERS
+    ) -> None:
         """
-        Download audio for a transcoding, writing an output audio file `output`.
+        Download audio for a transcoding, writing an output audio file `output` in the given
+        `format`. If the transcoding already is in that format, its segments are joined without
+        re-encoding. `output` is only written once the download has succeeded.
         """
 
-        audio_files = self._download_playlist(transcoding, "./.tmp")
-        audio_segments: list[AudioSegment] = [AudioSegment.from_file(f) for f in audio_files]
+        # written next to `output`, so that it can be moved into place atomically
+        with NamedTemporaryFile("wb", dir=dirname(output) or ".", suffix=".part", delete=False) as fl:
+            try:
+                self._join_playlist(transcoding, fl, format, workers)
+            except BaseException:
+                fl.close()
+                remove(fl.name)
+                raise
+
+        replace(fl.name, output)
 
-        combined = AudioSegment.empty()
+    def download_audio_buffer(
+        self, transcoding: MediaTranscoding, format: str = "mp3", workers: int = DOWNLOAD_WORKERS
+    ) -> io.BytesIO:
+        """
+        Like `download_audio`, but return the audio as an in-memory file, which can be passed
+        to `lync.aligner` in place of a path.
+        """
 
-        for audio_segment in audio_segments:
-            combined += audio_segment
+        buffer = io.BytesIO()
+        self._join_playlist(transcoding, buffer, format, workers)
+        buffer.seek(0)
 
-        combined.export(output, format="mp3")
+        return buffer
@@ -0,0 +1,131 @@
+from __future__ import annotations
+import asyncio
+import json
+from typing import Any, Iterable, Mapping, Optional, Union
+import aiohttp
+import requests
+from ..api import APIResponse, APIErrorData, APIErrorCode
+from ..async_api import AsyncAPIInterface, DEFAULT_CONCURRENCY, DEFAULT_RATE
+from . import SOUNDCLOUD_API_ROOT, UA, parse_search_result
+from .client_id import ClientIDCache, get_client_id, refresh_client_id
+from .models import SoundCloudSearchResult
+from .exceptions import SoundcloudSearchException
+
+
+class AsyncSoundcloudInterface(AsyncAPIInterface):
+    def _build_response(self, status: int, headers: Mapping[str, str], body: bytes) -> APIResponse:
+        if status in (401, 403):
+            return APIResponse.Error(APIErrorData(APIErrorCode.PermissionDenied, body))
+
+        try:
+            return APIResponse.Success(json.loads(body))
+        except ValueError:
+            return APIResponse.Error(APIErrorData(APIErrorCode.MalformedResponse, body))
+
+    def _build_headers(self) -> dict[str, str]:
+        headers = super()._build_headers()
+        headers["User-Agent"] = UA
+
+        return headers
+
+
+class AsyncSoundcloud:
+    """
+    asyncio counterpart of `Soundcloud` searches, for resolving many songs concurrently. Use
+    as an async context manager, which owns the underlying HTTP session:
+    ```
+    async with AsyncSoundcloud() as soundcloud:
+        tracks = await soundcloud.search_many(["drake - one dance", "starboy"])
+    ```
+    """
+
+    _api: AsyncSoundcloudInterface
+    _session: aiohttp.ClientSession
+    _client_id: Optional[str]
+    _client_id_cache: Optional[ClientIDCache]
+
+    def __init__(
+        self,
+        client_id: Optional[str] = None,
+        client_id_cache: Optional[ClientIDCache] = ClientIDCache(),
+        api_root: str = SOUNDCLOUD_API_ROOT,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        rate: float = DEFAULT_RATE,
+    ) -> None:
+        """
+        If `client_id` is not given, one is taken from `client_id_cache` or obtained when
+        entering the context, and replaced whenever the API rejects it. At most
+        `max_concurrency` requests are in flight, and at most `rate` are started per second,
+        per host. `api_root` can point to a local server for testing.
+        """
+
+        self._client_id = client_id
+        self._client_id_cache = client_id_cache
+        self._refresh_lock = asyncio.Lock()
+        self._api_root = api_root
+        self._max_concurrency = max_concurrency
+        self._rate = rate
+
+    async def __aenter__(self) -> AsyncSoundcloud:
+        if self._client_id is None:
+            # a one-off, so the blocking implementation runs in a thread
+            self._client_id = await asyncio.to_thread(
+                get_client_id, requests.Session(), self._client_id_cache
+            )
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self._max_concurrency)
+        )
+        self._api = AsyncSoundcloudInterface(
+            self._api_root, self._session, self._max_concurrency, self._rate
+        )
+
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self._session.close()
+
+    def _assert_ok(self, response: APIResponse) -> None:
+        if not response.ok():
+            raise SoundcloudSearchException(f"API call failed; error: {response.get_error().data}")
+
+    async def _refresh_client_id(self, stale_id: Optional[str]) -> None:
+        async with self._refresh_lock:
+            # concurrent requests rejected with the same ID refresh it only once
+            if self._client_id == stale_id:
+                self._client_id = await asyncio.to_thread(
+                    refresh_client_id, requests.Session(), stale_id, self._client_id_cache
+                )
+
+    async def _get(self, endpoint: str, query_params: dict[str, Any]) -> APIResponse:
+        """
+        Make an API request with the client ID, obtaining a new client ID and retrying once if
+        it was rejected.
+        """
+
+        client_id = self._client_id
+        response = await self._api.get(endpoint, {**query_params, "client_id": client_id})
+
+        if not response.ok() and response.get_error().code == APIErrorCode.PermissionDenied:
+            await self._refresh_client_id(client_id)
+            response = await self._api.get(endpoint, {**query_params, "client_id": self._client_id})
+
+        return response
+
+    async def search(self, query: str) -> Optional[SoundCloudSearchResult]:
+        response = await self._get("/search", {"q": query, "facet": "model"})
+        self._assert_ok(response)
+
+        return parse_search_result(response.get_data())
+
+    async def search_many(
+        self, queries: Iterable[str], return_exceptions: bool = False
+    ) -> list[Union[Optional[SoundCloudSearchResult], BaseException]]:
+        """
+        `search` every query in `queries` concurrently, returning the results in order. With
+        `return_exceptions`, failed searches return their exception instead of raising it.
+        """
+
+        return await asyncio.gather(
+            *(self.search(query) for query in queries), return_exceptions=return_exceptions
+        )
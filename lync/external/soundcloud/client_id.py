@@ -1,43 +1,184 @@
-import requests
+import json
+import os
 import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+import requests
 from .exceptions import SoundcloudClientIDException
+from ...profiling import count, profiled
+
+CLIENT_ID_CACHE_PATH = "./.cache/soundcloud_client_id.json"
+CLIENT_ID_TTL_SECONDS = 24 * 3600
+PROBE_WORKERS = 8
+PROBE_CHUNK_SIZE = 64 * 1024
+PROBE_TIMEOUT_SECONDS = 10
+
+# regex patterns
+
+SCRIPT_PATTERN = re.compile(r"<script .+?>")
+SRC_PATTERN = re.compile(r"(?<=src=\").+?(?=\")")
+# matched against the raw bytes of the scripts, which are streamed without decoding
+CLIENT_ID_PATTERN = re.compile(rb"(?<=client_id:\").+?(?=\")")
+# a match of `CLIENT_ID_PATTERN` is much shorter than this; keeping this many bytes of
+# the previous chunk of a script finds matches that straddle two chunks
+MATCH_OVERLAP = 256
+
+# serializes refreshes, so that concurrent failures within a process refresh the ID once
+_refresh_lock = threading.Lock()
+
+
+class ClientIDCache:
+    """
+    Small JSON file holding the last obtained client ID, shared by all processes using the
+    same `path`. An ID older than `ttl` seconds is treated as absent.
+    """
+
+    path: str
+    ttl: float
+
+    def __init__(self, path: str = CLIENT_ID_CACHE_PATH, ttl: float = CLIENT_ID_TTL_SECONDS) -> None:
+        self.path = path
+        self.ttl = ttl
 
+    def load(self) -> Optional[str]:
+        """
+        Return the cached client ID, or `None` if there is none or it expired.
+        """
 
-def obtain_client_id(session: requests.Session) -> str:
+        try:
+            with open(self.path, "r") as fl:
+                entry = json.load(fl)
+
+            if time.time() - entry["obtained_at"] > self.ttl:
+                return None
+
+            return entry["client_id"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def store(self, client_id: str) -> None:
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        # write to a temporary file and rename it into place, so readers never see a
+        # partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "w") as fl:
+                json.dump({"client_id": client_id, "obtained_at": time.time()}, fl)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def _probe_script(session: requests.Session, url: str, found: threading.Event) -> Optional[str]:
+    """
+    Stream the script at `url` and return the client ID in it, if any. Give up as soon as
+    `found` is set.
+    """
+
+    if found.is_set():
+        return None
+
+    try:
+        with session.get(url, stream=True, timeout=PROBE_TIMEOUT_SECONDS) as response:
+            if not response.ok:
+                return None
+
+            tail = b""
+
+            for chunk in response.iter_content(PROBE_CHUNK_SIZE):
+                if found.is_set():
+                    return None
+
+                data = tail + chunk
+
+                if match := CLIENT_ID_PATTERN.search(data):
+                    return match.group().decode()
+
+                tail = data[-MATCH_OVERLAP:]
+    except requests.RequestException:
+        pass
+
+    return None
+
+
+@profiled("soundcloud.obtain_client_id")
+def obtain_client_id(session: requests.Session, workers: int = PROBE_WORKERS) -> str:
     """
     Query the Soundcloud homepage and return a client ID.
 
     Soundcloud's internal API uses a client ID obtained as a hardcoded value in the bundled
-    js files included in every page.
+    js files included in every page. Up to `workers` of these are searched at once, and
+    the search stops at the first ID found.
     """
 
     URL = "https://soundcloud.com/discover"
 
-    # regex patterns
-
-    SCRIPT_PATTERN = r"<script .+?>"
-    SRC_PATTERN = r"(?<=src=\").+?(?=\")"
-    CLIENT_ID_PATTERN = r"(?<=client_id:\").+?(?=\")"
-
     response = session.get(URL)
 
     if not response.ok:
         raise SoundcloudClientIDException("Failed to obtain client ID")
 
     html_content = response.text
-    script_elements = re.findall(SCRIPT_PATTERN, html_content)
-    script_sources_match = (re.search(SRC_PATTERN, element) for element in script_elements)
+    script_elements = SCRIPT_PATTERN.findall(html_content)
+    script_sources_match = (SRC_PATTERN.search(element) for element in script_elements)
     script_sources = [match.group() for match in script_sources_match if match is not None]
 
-    for referenced_script in script_sources:
-        response = session.get(referenced_script)
+    found = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers)
 
-        if not response.ok: continue
+    try:
+        # the ID is defined in one of the last bundles, so those are probed first
+        futures = [
+            executor.submit(_probe_script, session, referenced_script, found)
+            for referenced_script in reversed(script_sources)
+        ]
 
-        js_source = response.text
+        for future in as_completed(futures):
+            if client_id := future.result():
+                found.set()
+                return client_id
+    finally:
+        # drop the probes that have not started, and let running ones notice `found`
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        if match := re.search(CLIENT_ID_PATTERN, js_source):
-            return match.group()
-    
     raise SoundcloudClientIDException("Failed to obtain client ID")
-            
\ No newline at end of file
+
+
+def get_client_id(session: requests.Session, cache: Optional[ClientIDCache] = None) -> str:
+    """
+    Return the client ID in `cache`, obtaining and caching a new one if there is none.
+    """
+
+    if cache is not None and (client_id := cache.load()):
+        return client_id
+
+    return refresh_client_id(session, None, cache)
+
+
+def refresh_client_id(
+    session: requests.Session, stale_id: Optional[str], cache: Optional[ClientIDCache] = None
+) -> str:
+    """
+    Return a client ID to replace `stale_id`, which was rejected by the API. If another
+    thread or process has already put a different ID in `cache`, that one is returned;
+    otherwise a new one is obtained and cached.
+    """
+
+    with _refresh_lock:
+        if cache is not None and (client_id := cache.load()) and client_id != stale_id:
+            return client_id
+
+        client_id = obtain_client_id(session)
+        count("soundcloud.client_id_refreshes")
+
+        if cache is not None:
+            cache.store(client_id)
+
+        return client_id
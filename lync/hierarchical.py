@@ -0,0 +1,279 @@
+from __future__ import annotations
+import bisect
+from concurrent.futures import Executor
+from typing import Optional
+import torch
+from .profiling import profiled, stage
+from .aligner import PathArrays, backtrack_path, band_centers, clean_transcript, coarse_entries, get_trellis_path
+
+# frames per block of the coarse alignment anchors are looked for in; it only has to tell
+# which pause a line break falls in, so it is coarser than the bands of the parts need
+ANCHOR_FACTOR = 16
+# minimum pause, in frames, at a line break for it to be used as an anchor (0.2s)
+MIN_GAP_FRAMES = 10
+# a part whose path comes this close to one of its split frames is rejected
+BOUNDARY_MARGIN = 2
+# parts are not made smaller than this many tokens
+MIN_SPAN_TOKENS = 200
+
+Span = tuple[int, int]
+# the path of a part, and whether it is also the best path of the part when not anchored
+Solution = tuple[PathArrays, bool]
+
+
+def line_break_tokens(transcript: str) -> list[int]:
+    """
+    Return the indices of the tokens of `clean_transcript(transcript)` that are the
+    separators standing in for line breaks, and are followed by a letter.
+    """
+
+    cleaned = clean_transcript(transcript)
+    breaks: list[int] = []
+    position = 0
+
+    # mirror `clean_transcript` character by character to keep track of token indices
+    for char in transcript.strip():
+        kept = "".join(c for c in (" " if char == "\n" else char).upper() if c.isalpha() or c == " ")
+
+        if char == "\n" and position + 1 < len(cleaned) and cleaned[position + 1] != "|":
+            breaks.append(position)
+
+        position += len(kept)
+
+    return breaks
+
+
+def blank_frames(emission: torch.Tensor, blank_id: int = 0) -> torch.Tensor:
+    """
+    Return whether the blank is the most likely label of each frame of `emission`.
+    """
+
+    return emission.argmax(1) == blank_id
+
+
+def _pauses(blank: torch.Tensor, min_gap: int) -> tuple[list[int], list[int]]:
+    """
+    Return the first frames and the ends of the runs of at least `min_gap` frames in
+    `blank`.
+    """
+
+    edge = torch.zeros(1, dtype=torch.int8)
+    edges = torch.diff(blank.to(torch.int8), prepend=edge, append=edge)
+    firsts = torch.nonzero(edges == 1).flatten()
+    ends = torch.nonzero(edges == -1).flatten()
+    long = ends - firsts >= min_gap
+
+    return firsts[long].tolist(), ends[long].tolist()
+
+
+@profiled("hierarchical.find_anchors")
+def find_anchors(
+    entries: torch.Tensor,
+    breaks: list[int],
+    blank: torch.Tensor,
+    min_gap: int = MIN_GAP_FRAMES,
+    min_span_tokens: int = MIN_SPAN_TOKENS,
+) -> list[tuple[int, int]]:
+    """
+    Return `(token, frame)` pairs of line breaks at which the song can be split, given the
+    trellis rows `entries` the tokens are entered on in a coarse alignment (see
+    `coarse_entries`) and the `blank_frames` of the emission: the separator token `token`
+    of a line break in `breaks` that the coarse alignment holds across a pause of at least
+    `min_gap` blank frames, and the frame in the middle of that pause. Anchors are at least
+    `min_span_tokens` tokens apart.
+
+    Only the pauses at line breaks are looked at, and the coarse alignment need only place
+    a line break within its pause; `hierarchical_path` checks every split against the paths
+    of the parts next to it.
+    """
+
+    num_tokens = len(entries)
+    # trellis row `t` is entered on frame `t - 1`
+    starts = (entries.round().long() - 1).tolist()
+    firsts, ends = _pauses(blank, min_gap)
+
+    anchors: list[tuple[int, int]] = []
+    last_token = 0
+
+    for token in breaks:
+        if token + 1 - last_token < min_span_tokens or num_tokens - token - 1 < min_span_tokens:
+            continue
+
+        # the separator is held for the duration of the pause after the line; take the
+        # pause it is held across for the most frames, and at least `min_gap` of them
+        first, end = starts[token], starts[token + 1]
+        pause, overlap = None, min_gap - 1
+        for index in range(max(bisect.bisect_right(firsts, first) - 1, 0), len(firsts)):
+            if firsts[index] >= end:
+                break
+            if min(ends[index], end) - max(firsts[index], first) > overlap:
+                pause, overlap = index, min(ends[index], end) - max(firsts[index], first)
+
+        if pause is None:
+            continue
+
+        anchors.append((token, (firsts[pause] + ends[pause]) // 2))
+        last_token = token + 1
+
+    return anchors
+
+
+def _is_prefix(path: PathArrays, of: PathArrays) -> bool:
+    n = len(path)
+    return (
+        n <= len(of)
+        and torch.equal(path.token_index, of.token_index[:n])
+        and torch.equal(path.time_index, of.time_index[:n])
+    )
+
+
+def solve_span(
+    emission: torch.Tensor,
+    tokens: list[int],
+    anchored: bool,
+    band_width: Optional[int] = None,
+    coarse_factor: Optional[int] = None,
+    blank_id: int = 0,
+    centers: Optional[torch.Tensor] = None,
+) -> Optional[Solution]:
+    """
+    Align a part of a song as `get_trellis_path` does, returning `None` if it cannot be
+    aligned.
+
+    An anchored part is also backtracked from the best scoring frame of its last token, on
+    the same trellis; the part is stable if its anchored path only continues that path.
+    """
+
+    try:
+        trellis, path = get_trellis_path(emission, tokens, band_width, coarse_factor, blank_id, anchored, centers)
+    except ValueError:
+        return None
+
+    if not anchored:
+        return path, True
+
+    try:
+        return path, _is_prefix(backtrack_path(trellis, emission, tokens, blank_id), path)
+    except ValueError:
+        return path, False
+
+
+def _boundary_ok(before: PathArrays, before_first: int, split: int, after: PathArrays, blank: torch.Tensor, margin: int) -> bool:
+    """
+    Check that neither of two neighbouring parts needed to cross the frame `split` they
+    were split at, the part before starting on frame `before_first`: the part before must
+    finish its last word, and the part after start its first, at least `margin` frames away
+    from it, with nothing but `blank_frames` in between. A split at the wrong line break
+    would have one of the parts hold the separator across words.
+    """
+
+    # the part before ends with the separator of the line break
+    separator = before.token_index[-1]
+    separator_start = before_first + before.time_index[before.token_index == separator][0].item()
+    first_start = split + after.time_index[0].item()
+
+    return (
+        split - separator_start >= margin
+        and first_start - split >= margin
+        and bool(blank[separator_start + 1:first_start].all())
+    )
+
+
+def hierarchical_path(
+    emission: torch.Tensor,
+    tokens: list[int],
+    transcript: str,
+    executor: Optional[Executor] = None,
+    band_width: Optional[int] = None,
+    coarse_factor: Optional[int] = None,
+    margin: int = BOUNDARY_MARGIN,
+    blank_id: int = 0,
+    **anchor_options,
+) -> PathArrays:
+    """
+    Align `tokens` (the tokens of `transcript`) to `emission` by splitting the song at
+    confident line breaks (see `find_anchors`) and aligning the parts independently, on
+    `executor` if one is given.
+
+    Anchors are looked for in the coarse alignment of `coarse_entries` at `ANCHOR_FACTOR`
+    frames per block, which is the only part of the work that is not split. The parts are
+    aligned with bands on their own coarse alignment at `coarse_factor` frames per block,
+    or on that of the anchors without one. Each part ends on the separator of its line
+    break and is forced to end on the frame it was split at, so the result is the best path
+    among those holding the separator of every line break split at on its split frame; it
+    is not checked against the best path of the whole song. A split is dropped if a part
+    next to it fails to align, if the paths on either side of it leave anything but blank
+    frames between them (see `_boundary_ok`), or if the part before it would end elsewhere
+    when not forced to (see `solve_span`); the neighbouring parts are joined and aligned
+    again until every remaining split holds, which in the worst case is the alignment of
+    the whole song.
+    """
+
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+
+    with stage("hierarchical.coarse_entries"):
+        entries = coarse_entries(emission, tokens, ANCHOR_FACTOR, blank_id)
+    blank = blank_frames(emission, blank_id)
+    anchors = []
+    if entries is not None:
+        anchors = find_anchors(entries, line_break_tokens(transcript), blank, **anchor_options)
+    # split points as (first token, first frame) of the part after them
+    bounds = [(0, 0)] + [(token + 1, frame) for token, frame in anchors] + [(num_tokens, num_frame)]
+    splits = list(range(len(bounds)))
+    solved: dict[Span, Optional[Solution]] = {}
+
+    while True:
+        spans = list(zip(splits[:-1], splits[1:]))
+
+        unsolved = [span for span in spans if span not in solved]
+        args, options = [], []
+        for a, b in unsolved:
+            (first_token, first_frame), (end_token, end_frame) = bounds[a], bounds[b]
+            anchored = b != len(bounds) - 1
+            args.append((emission[first_frame:end_frame].clone(), tokens[first_token:end_token], anchored))
+
+            centers = None
+            if entries is not None and not coarse_factor:
+                centers = band_centers(entries[first_token:end_token] - first_frame, end_frame - first_frame, anchored)
+            options.append({"band_width": band_width, "coarse_factor": coarse_factor, "blank_id": blank_id, "centers": centers})
+
+        if executor is None:
+            results = [solve_span(*arg, **option) for arg, option in zip(args, options)]
+        else:
+            futures = [executor.submit(solve_span, *arg, **option) for arg, option in zip(args, options)]
+            results = [future.result() for future in futures]
+        solved.update(zip(unsolved, results))
+
+        if len(spans) == 1 and solved[spans[0]] is None:
+            raise ValueError("Failed to align")
+
+        # indices into `splits` of the splits that do not hold
+        failed = set()
+        for index, (a, b) in enumerate(spans):
+            solution = solved[(a, b)]
+            if solution is None:
+                failed.update({index, index + 1})
+                continue
+
+            path, stable = solution
+            if not stable:
+                failed.add(index + 1)
+            elif index + 1 < len(spans):
+                after = solved[spans[index + 1]]
+                if after is not None and not _boundary_ok(path, bounds[a][1], bounds[b][1], after[0], blank, margin):
+                    failed.add(index + 1)
+
+        # the first and last split are the ends of the song
+        failed -= {0, len(splits) - 1}
+        if not failed:
+            break
+
+        splits = [split for index, split in enumerate(splits) if index not in failed]
+
+    paths = [solved[span][0] for span in spans]
+    return PathArrays(
+        torch.cat([path.token_index + bounds[a][0] for path, (a, _) in zip(paths, spans)]),
+        torch.cat([path.time_index + bounds[a][1] for path, (a, _) in zip(paths, spans)]),
+        torch.cat([path.score for path in paths]),
+    )
@@ -0,0 +1,450 @@
+from __future__ import annotations
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO
+from .emission_cache import STALE_TMP_SECONDS, hash_audio
+
+ARTIFACT_DIR = "./.cache/artifacts"
+DONE_MARKER = "done.json"
+
+QUEUE_SIZE = 4
+NETWORK_WORKERS = 4
+SEPARATE_WORKERS = 1
+ALIGN_WORKERS = 1
+REPORT_INTERVAL_SECONDS = 10.0
+
+SEPARATOR_MODEL = "spleeter:2stems"
+CACHE_FOREVER = -1
+IMAGE_UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36"
+
+
+class ArtifactStore:
+    """
+    On-disk store of the outputs of pipeline stages, keyed by the content they were computed
+    from (see `key`).
+
+    Every entry is a directory of files and a marker holding its metadata. Entries are built
+    in a temporary directory that is renamed into place once complete, so a stage that
+    crashes leaves no entry behind and is simply run again, and concurrent runs sharing a
+    store never see a partial entry. Temporary directories left by killed runs are removed
+    once they are older than `STALE_TMP_SECONDS`.
+    """
+
+    directory: str
+
+    def __init__(self, directory: str = ARTIFACT_DIR) -> None:
+        self.directory = directory
+
+    @staticmethod
+    def key(stage: str, **inputs: Any) -> str:
+        """
+        Return the key of the output of `stage` computed from `inputs`, which should be
+        digests of input files and the parameters of the stage.
+        """
+
+        description = json.dumps({"stage": stage, **inputs}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.directory, stage, key)
+
+    def get(self, stage: str, key: str) -> Optional[dict]:
+        """
+        Return the metadata of the entry for `key`, or `None` if there is none.
+        """
+
+        try:
+            with open(os.path.join(self.path(stage, key), DONE_MARKER), "r") as fl:
+                return json.load(fl)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, stage: str, key: str, build: Callable[[str], dict]) -> dict:
+        """
+        Create the entry for `key` by calling `build` with the directory to write its files
+        to. `build` returns the metadata of the entry.
+        """
+
+        stage_dir = os.path.join(self.directory, stage)
+        os.makedirs(stage_dir, exist_ok=True)
+        self._remove_stale(stage_dir)
+        tmp_dir = tempfile.mkdtemp(dir=stage_dir, prefix=".tmp-")
+
+        try:
+            metadata = build(tmp_dir)
+
+            with open(os.path.join(tmp_dir, DONE_MARKER), "w") as fl:
+                json.dump(metadata, fl)
+
+            try:
+                os.rename(tmp_dir, self.path(stage, key))
+            except OSError:
+                # another run finished the same entry first
+                shutil.rmtree(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        return metadata
+
+    @staticmethod
+    def _remove_stale(stage_dir: str) -> None:
+        now = time.time()
+
+        for entry in os.scandir(stage_dir):
+            if not entry.name.startswith(".tmp-"):
+                continue
+
+            try:
+                stale = now - entry.stat().st_mtime > STALE_TMP_SECONDS
+            except FileNotFoundError:
+                # finished or removed by another process in the meantime
+                continue
+
+            if stale:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+@dataclass
+class Song:
+    """
+    A song on its way through the pipeline, with the paths of the artifacts produced so far.
+    """
+
+    query: str
+    title: Optional[str] = None
+    artist_name: Optional[str] = None
+    lyrics_path: Optional[str] = None
+    cover_path: Optional[str] = None
+    audio_path: Optional[str] = None
+    vocals_path: Optional[str] = None
+    transcript_path: Optional[str] = None
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    queue: queue.Queue
+    busy: int = 0
+    done: int = 0
+    cached: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        throughput = 60 * self.done / elapsed if elapsed > 0 else 0.0
+
+        return (
+            f"{self.name:<10} queue {self.queue.qsize()}/{self.queue.maxsize}"
+            f"  busy {self.busy}/{self.workers}"
+            f"  done {self.done} ({self.cached} cached)  failed {self.failed}"
+            f"  {throughput:.1f} songs/min"
+        )
+
+
+# end of the stream of songs through a queue
+_END = None
+
+# state of pool worker processes, created once per process by the initializers
+_separator = None
+_aligner = None
+
+
+def _init_separator(model: str) -> None:
+    global _separator
+    from spleeter.separator import Separator
+
+    # the pipeline already runs one song per worker process
+    _separator = Separator(model, multiprocess=False)
+
+
+def _separate_vocals(audio_path: str, output_dir: str) -> None:
+    _separator.separate_to_file(audio_path, output_dir, filename_format="{instrument}.{codec}")
+
+
+def _init_aligner(options: dict[str, Any], threads: int) -> None:
+    global _aligner
+    import torch
+    from .aligner import Aligner
+
+    torch.set_num_threads(threads)
+    _aligner = Aligner(**options)
+
+
+def _align_song(vocals_path: str, lyrics_path: str, outfile_path: str) -> None:
+    _aligner.align(vocals_path, lyrics_path, outfile_path)
+
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as fl:
+        return hashlib.sha256(fl.read()).hexdigest()
+
+
+class Pipeline:
+    """
+    Batch pipeline turning song queries into lyrics, cover art, audio, separated vocals and
+    aligned transcripts.
+
+    Stages run side by side, connected by queues of `queue_size` songs, so that a slow stage
+    holds back the ones before it instead of piling up work. The network stages (Genius and
+    Soundcloud) run `network_workers` songs at a time on threads; separation and alignment
+    run on process pools of `separate_workers` and `align_workers` processes, each of which
+    creates its `Separator` or `Aligner` (constructed with `aligner_options`) once.
+
+    Every stage output is kept in `store`, so songs that were (partly) processed by an
+    earlier run resume after their last finished stage. Queue depth, activity and
+    throughput of every stage are written to `report_file` every `report_interval` seconds.
+    """
+
+    store: ArtifactStore
+
+    def __init__(
+        self,
+        store: Optional[ArtifactStore] = None,
+        network_workers: int = NETWORK_WORKERS,
+        separate_workers: int = SEPARATE_WORKERS,
+        align_workers: int = ALIGN_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+        aligner_options: Optional[dict[str, Any]] = None,
+        report_interval: float = REPORT_INTERVAL_SECONDS,
+        report_file: TextIO = sys.stderr,
+    ) -> None:
+        self.store = store if store is not None else ArtifactStore()
+        self.network_workers = network_workers
+        self.separate_workers = separate_workers
+        self.align_workers = align_workers
+        self.queue_size = queue_size
+        self.aligner_options = aligner_options or {}
+        self.report_interval = report_interval
+        self.report_file = report_file
+
+        self.failures: list[tuple[str, str, BaseException]] = []
+        self._lock = threading.Lock()
+        # API clients are not shared between threads
+        self._local = threading.local()
+        self._separate_pool: Optional[ProcessPoolExecutor] = None
+        self._align_pool: Optional[ProcessPoolExecutor] = None
+
+    def _cached(self, stage: str, key: str, build: Callable[[str], dict]) -> tuple[dict, str, bool]:
+        """
+        Return the metadata and directory of the entry for `key`, building it if needed, and
+        whether it was already stored.
+        """
+
+        metadata = self.store.get(stage, key)
+        cached = metadata is not None
+
+        if not cached:
+            metadata = self.store.put(stage, key, build)
+
+        return metadata, self.store.path(stage, key), cached
+
+    def _fetch_lyrics(self, song: Song) -> tuple[Song, bool]:
+        from .external.genius import Genius
+
+        def build(output_dir: str) -> dict:
+            if not hasattr(self._local, "genius"):
+                self._local.genius = Genius(CACHE_FOREVER)
+            genius = self._local.genius
+
+            result = genius.search(song.query)
+            if result is None:
+                raise LookupError("No Genius result")
+
+            with open(os.path.join(output_dir, "lyrics.txt"), "w") as fl:
+                for line in genius.get_lyrics(result).lines:
+                    print(line.text, file=fl)
+
+            cover = "cover." + result.song_image_url.split(".")[-1]
+            request = urllib.request.Request(result.song_image_url, headers={"User-Agent": IMAGE_UA})
+            with urllib.request.urlopen(request) as response, open(os.path.join(output_dir, cover), "wb") as fl:
+                shutil.copyfileobj(response, fl)
+
+            return {"title": result.title, "artist_name": result.artist_name, "lyrics": "lyrics.txt", "cover": cover}
+
+        metadata, path, cached = self._cached("lyrics", self.store.key("lyrics", query=song.query), build)
+
+        return replace(
+            song,
+            title=metadata["title"],
+            artist_name=metadata["artist_name"],
+            lyrics_path=os.path.join(path, metadata["lyrics"]),
+            cover_path=os.path.join(path, metadata["cover"]),
+        ), cached
+
+    def _fetch_audio(self, song: Song) -> tuple[Song, bool]:
+        from .external.soundcloud import Soundcloud
+
+        def build(output_dir: str) -> dict:
+            if not hasattr(self._local, "soundcloud"):
+                self._local.soundcloud = Soundcloud()
+            soundcloud = self._local.soundcloud
+
+            result = soundcloud.search(song.query)
+            if result is None:
+                raise LookupError("No Soundcloud result")
+
+            transcoding = result.get_transcoding("audio/mpeg")
+            if transcoding is None:
+                raise LookupError("No mp3 transcoding")
+
+            soundcloud.download_audio(transcoding, os.path.join(output_dir, "audio.mp3"))
+
+            return {"audio": "audio.mp3"}
+
+        metadata, path, cached = self._cached("audio", self.store.key("audio", query=song.query), build)
+
+        return replace(song, audio_path=os.path.join(path, metadata["audio"])), cached
+
+    def _separate(self, song: Song) -> tuple[Song, bool]:
+        def build(output_dir: str) -> dict:
+            self._separate_pool.submit(_separate_vocals, song.audio_path, output_dir).result()
+            # the accompaniment is not used
+            os.remove(os.path.join(output_dir, "accompaniment.wav"))
+
+            return {"vocals": "vocals.wav"}
+
+        key = self.store.key("vocals", audio=hash_audio(song.audio_path), model=SEPARATOR_MODEL)
+        metadata, path, cached = self._cached("vocals", key, build)
+
+        return replace(song, vocals_path=os.path.join(path, metadata["vocals"])), cached
+
+    def _align(self, song: Song) -> tuple[Song, bool]:
+        def build(output_dir: str) -> dict:
+            outfile_path = os.path.join(output_dir, "transcript.json")
+            self._align_pool.submit(_align_song, song.vocals_path, song.lyrics_path, outfile_path).result()
+
+            return {"transcript": "transcript.json"}
+
+        key = self.store.key(
+            "transcript",
+            vocals=hash_audio(song.vocals_path),
+            lyrics=_hash_file(song.lyrics_path),
+            aligner=self.aligner_options,
+        )
+        metadata, path, cached = self._cached("transcript", key, build)
+
+        return replace(song, transcript_path=os.path.join(path, metadata["transcript"])), cached
+
+    def _work(
+        self,
+        stage: StageStats,
+        function: Callable[[Song], tuple[Song, bool]],
+        output: queue.Queue,
+        live: list[int],
+    ) -> None:
+        while (song := stage.queue.get()) is not _END:
+            with self._lock:
+                stage.busy += 1
+
+            try:
+                song, cached = function(song)
+            except Exception as error:
+                with self._lock:
+                    stage.busy -= 1
+                    stage.failed += 1
+                    self.failures.append((song.query, stage.name, error))
+                print(f'{stage.name}: "{song.query}" failed: {error!r}', file=self.report_file)
+                continue
+
+            with self._lock:
+                stage.busy -= 1
+                stage.done += 1
+                stage.cached += cached
+
+            output.put(song)
+
+        # let the other workers of the stage see the end too; the last one passes it on
+        stage.queue.put(_END)
+        with self._lock:
+            live[0] -= 1
+            last = live[0] == 0
+        if last:
+            output.put(_END)
+
+    def _report(self, stages: list[StageStats]) -> None:
+        with self._lock:
+            lines = [stage.report() for stage in stages]
+
+        print("\n".join(lines), file=self.report_file, flush=True)
+
+    def run(self, queries: Iterable[str]) -> Iterator[Song]:
+        """
+        Run every query in `queries` through the pipeline, yielding songs as they finish.
+        Songs that fail at some stage are reported and recorded in `failures`.
+        """
+
+        context = multiprocessing.get_context("spawn")
+        threads = max(1, (os.cpu_count() or 1) // max(1, self.align_workers))
+        self._separate_pool = ProcessPoolExecutor(
+            self.separate_workers, context, initializer=_init_separator, initargs=(SEPARATOR_MODEL,)
+        )
+        self._align_pool = ProcessPoolExecutor(
+            self.align_workers, context, initializer=_init_aligner, initargs=(self.aligner_options, threads)
+        )
+
+        plan = [
+            ("lyrics", self._fetch_lyrics, self.network_workers),
+            ("audio", self._fetch_audio, self.network_workers),
+            ("separate", self._separate, self.separate_workers),
+            ("align", self._align, self.align_workers),
+        ]
+        stages = [StageStats(name, workers, queue.Queue(self.queue_size)) for name, _, workers in plan]
+        finished: queue.Queue = queue.Queue(self.queue_size)
+        outputs = [stage.queue for stage in stages[1:]] + [finished]
+
+        for stage, (_, function, workers), output in zip(stages, plan, outputs):
+            live = [workers]
+            for _ in range(workers):
+                threading.Thread(target=self._work, args=(stage, function, output, live), daemon=True).start()
+
+        def feed() -> None:
+            for query in queries:
+                stages[0].queue.put(Song(query))
+            stages[0].queue.put(_END)
+
+        def report() -> None:
+            while not stopped.wait(self.report_interval):
+                self._report(stages)
+
+        stopped = threading.Event()
+        threading.Thread(target=feed, daemon=True).start()
+        threading.Thread(target=report, daemon=True).start()
+
+        try:
+            while (song := finished.get()) is not _END:
+                yield song
+        finally:
+            stopped.set()
+            self._report(stages)
+            self._separate_pool.shutdown(cancel_futures=True)
+            self._align_pool.shutdown(cancel_futures=True)
+
+
+def export_song(song: Song, output_dir: str) -> None:
+    """
+    Copy the artifacts of a finished song to `output_dir`, named after its query.
+    """
+
+    name = song.query
+    vocals_dir = os.path.join(output_dir, name)
+    os.makedirs(vocals_dir, exist_ok=True)
+
+    shutil.copyfile(song.lyrics_path, os.path.join(output_dir, name + ".txt"))
+    shutil.copyfile(song.cover_path, os.path.join(output_dir, name + os.path.splitext(song.cover_path)[1]))
+    shutil.copyfile(song.audio_path, os.path.join(output_dir, name + ".mp3"))
+    shutil.copyfile(song.vocals_path, os.path.join(vocals_dir, "vocals.wav"))
+    shutil.copyfile(song.transcript_path, os.path.join(output_dir, name + "-transcript.json"))
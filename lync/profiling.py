@@ -0,0 +1,226 @@
+from __future__ import annotations
+import functools
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional, TypeVar
+
+
+@dataclass
+class Record:
+    """
+    A measurement reported to the sink: either a timed stage, with its wall time, the peak
+    of traced memory above what was allocated when it started (only while `tracemalloc` is
+    tracing), and the net change in allocated memory blocks; or a counter increment, with
+    only `value` set.
+    """
+
+    name: str
+    wall_s: Optional[float] = None
+    peak_bytes: Optional[int] = None
+    allocated_blocks: Optional[int] = None
+    value: int = 0
+
+
+Sink = Callable[[Record], None]
+
+# no sink means instrumentation is disabled and costs a single check
+_sink: Optional[Sink] = None
+
+
+def set_sink(sink: Optional[Sink]) -> Optional[Sink]:
+    """
+    Send records of all stages and counters to `sink`, or disable instrumentation with
+    `None`. Return the previous sink.
+
+    The sink is process-wide and may be called from several threads. Stages run in worker
+    processes are not reported to the sink of the parent process.
+    """
+
+    global _sink
+    previous, _sink = _sink, sink
+
+    return previous
+
+
+def enabled() -> bool:
+    return _sink is not None
+
+
+@dataclass
+class _Frame:
+    start_traced: int
+    peak: int = 0
+
+
+# stages currently running in this thread or task
+_stack: ContextVar[tuple[_Frame, ...]] = ContextVar("stages", default=())
+
+
+def _fold_peak(stack: tuple[_Frame, ...]) -> None:
+    """
+    Fold the traced peak since the last reset into every running stage, then reset it, so
+    nested stages each see their own peak.
+    """
+
+    peak = tracemalloc.get_traced_memory()[1]
+    for frame in stack:
+        frame.peak = max(frame.peak, peak)
+    tracemalloc.reset_peak()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time the enclosed block as the stage `name`.
+
+    Peaks are measured with `tracemalloc`'s process-wide peak, so they include memory
+    allocated by other threads running at the same time.
+    """
+
+    sink = _sink
+    if sink is None:
+        yield
+        return
+
+    tracing = tracemalloc.is_tracing()
+    stack = _stack.get()
+    frame = _Frame(tracemalloc.get_traced_memory()[0] if tracing else 0)
+
+    if tracing:
+        _fold_peak(stack)
+
+    token = _stack.set(stack + (frame,))
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        wall_s = time.perf_counter() - start
+        allocated_blocks = sys.getallocatedblocks() - blocks
+        _stack.reset(token)
+
+        peak_bytes = None
+        if tracing and tracemalloc.is_tracing():
+            _fold_peak(stack + (frame,))
+            peak_bytes = max(frame.peak - frame.start_traced, 0)
+
+        sink(Record(name, wall_s, peak_bytes, allocated_blocks))
+
+
+F = TypeVar("F", bound=Callable)
+
+
+def profiled(name: str) -> Callable[[F], F]:
+    """
+    Decorator timing every call of a function as the stage `name`.
+    """
+
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return function(*args, **kwargs)
+
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Increment the counter `name` by `value`.
+    """
+
+    sink = _sink
+    if sink is not None:
+        sink(Record(name, value=value))
+
+
+@dataclass
+class StageSummary:
+    calls: int = 0
+    wall_s: float = 0.0
+    max_wall_s: float = 0.0
+    peak_bytes: Optional[int] = None
+    allocated_blocks: int = 0
+
+
+@dataclass
+class Profiler:
+    """
+    Sink aggregating records per stage and counter:
+    ```
+    profiler = Profiler()
+    with profiler.active():
+        aligner.align(...)
+    print(profiler.report())
+    ```
+    """
+
+    stages: dict[str, StageSummary] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def __call__(self, record: Record) -> None:
+        with self._lock:
+            if record.wall_s is None:
+                self.counters[record.name] = self.counters.get(record.name, 0) + record.value
+                return
+
+            summary = self.stages.setdefault(record.name, StageSummary())
+            summary.calls += 1
+            summary.wall_s += record.wall_s
+            summary.max_wall_s = max(summary.max_wall_s, record.wall_s)
+            summary.allocated_blocks += record.allocated_blocks or 0
+            if record.peak_bytes is not None:
+                summary.peak_bytes = max(summary.peak_bytes or 0, record.peak_bytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    @contextmanager
+    def active(self, trace_memory: bool = True) -> Iterator[Profiler]:
+        """
+        Make this profiler the sink for the enclosed block, tracing memory allocations with
+        `tracemalloc` if `trace_memory` (which slows allocations down considerably).
+        """
+
+        previous = set_sink(self)
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+
+        try:
+            yield self
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            set_sink(previous)
+
+    def report(self) -> str:
+        lines = [f"{'stage':<28} {'calls':>6} {'total (ms)':>11} {'max (ms)':>10} {'peak (KiB)':>11} {'blocks':>9}"]
+
+        for name, summary in sorted(self.stages.items(), key=lambda item: -item[1].wall_s):
+            peak = f"{summary.peak_bytes / 1024:.0f}" if summary.peak_bytes is not None else "-"
+            lines.append(
+                f"{name:<28} {summary.calls:>6} {summary.wall_s * 1000:>11.2f} "
+                f"{summary.max_wall_s * 1000:>10.2f} {peak:>11} {summary.allocated_blocks:>9}"
+            )
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<28} {value:>6}")
+
+        return "\n".join(lines)
@@ -0,0 +1,278 @@
+from __future__ import annotations
+import json
+import math
+import os
+import subprocess
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+FPS = 24
+FONTS = ["Arial.ttf", "arial.ttf", "DejaVuSans.ttf"]
+FONT_SIZE = 40
+TEXT_COLOR = "yellow"
+STROKE_COLOR = "black"
+STROKE_WIDTH = 2
+# lines with more words are broken in two rows, so they fit on the screen
+WORDS_PER_ROW = 6
+
+Rect = tuple[int, int, int, int]
+
+
+def wrap_line(text: str) -> str:
+    words = text.split(" ")
+
+    if len(words) > WORDS_PER_ROW:
+        words.insert(WORDS_PER_ROW, "\n")
+        text = " ".join(words)
+
+    return text
+
+
+def load_font(size: int = FONT_SIZE) -> ImageFont.ImageFont:
+    for name in FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+
+    return ImageFont.load_default(size)
+
+
+def rasterize(text: str, font: ImageFont.ImageFont) -> np.ndarray:
+    """
+    Draw `text` in the lyric style and return it as an RGBA image of shape `(h, w, 4)`.
+    """
+
+    options = dict(font=font, align="center", stroke_width=STROKE_WIDTH)
+    bbox = ImageDraw.Draw(Image.new("RGBA", (1, 1))).multiline_textbbox((0, 0), text, **options)
+    # centered rows of a wrapped line can have fractional coordinates
+    left, top = math.floor(bbox[0]), math.floor(bbox[1])
+    right, bottom = math.ceil(bbox[2]), math.ceil(bbox[3])
+
+    image = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(image).multiline_text(
+        (-left, -top), text, fill=TEXT_COLOR, stroke_fill=STROKE_COLOR, **options
+    )
+
+    return np.asarray(image)
+
+
+def caption_position(t: float, size: tuple[int, int]) -> tuple[int, int]:
+    """
+    Return the position of the top left corner of a line `t` seconds after it appeared in a
+    video of `size`: it slides in from the right to the bottom of the screen.
+    """
+
+    w, h = size
+    return int(max(w / 30, int(w - 0.5 * w * t))), int(max(5 * h / 6, int(100 * t)))
+
+
+@dataclass
+class Caption:
+    """
+    A rasterized line, stored as premultiplied color and alpha for blending.
+    """
+
+    begin: float
+    end: float
+    color: np.ndarray
+    alpha: np.ndarray
+
+    @staticmethod
+    def from_rgba(begin: float, end: float, rgba: np.ndarray) -> Caption:
+        alpha = rgba[..., 3:].astype(np.float32) / 255
+        return Caption(begin, end, rgba[..., :3] * alpha, alpha)
+
+
+class IntervalIndex:
+    """
+    Index of the intervals `[begin, end)` of captions, answering which of them contain a
+    given time.
+    """
+
+    def __init__(self, begins: list[float], ends: list[float]) -> None:
+        self._order = sorted(range(len(begins)), key=lambda i: begins[i])
+        self._begins = [begins[i] for i in self._order]
+        self._ends = [ends[i] for i in self._order]
+        self._max_length = max((end - begin for begin, end in zip(begins, ends)), default=0.0)
+
+    def active(self, t: float) -> list[int]:
+        """
+        Return the indices of the intervals containing `t`, in increasing order.
+        """
+
+        # only intervals beginning at most the longest interval length before `t` can reach it
+        lo = bisect_left(self._begins, t - self._max_length)
+        hi = bisect_right(self._begins, t)
+
+        return sorted(self._order[k] for k in range(lo, hi) if self._ends[k] > t)
+
+
+def read_fragments(transcript_path: str) -> list[tuple[str, float, float]]:
+    """
+    Return the `(text, begin, end)` of every line of a transcript written by
+    `lync.aligner.export_transcript`, leaving out lines that were not aligned.
+    """
+
+    with open(transcript_path, "r") as fl:
+        transcript = json.load(fl)
+
+    fragments = [
+        (fragment["lines"][0], float(fragment["begin"]), float(fragment["end"]))
+        for fragment in transcript["fragments"]
+    ]
+    return [(text, begin, end) for text, begin, end in fragments if end > begin]
+
+
+class CaptionRenderer:
+    """
+    Renders frames of lines over a static background.
+
+    Lines are rasterized once. Each frame is drawn into the same buffer, in which only the
+    areas covered by lines in the previous frame are restored from the background before
+    blending the lines active in this frame.
+    """
+
+    def __init__(self, background: np.ndarray, fragments: list[tuple[str, float, float]]) -> None:
+        font = load_font()
+
+        self.background = background
+        self.size = (background.shape[1], background.shape[0])
+        self.captions = [Caption.from_rgba(begin, end, rasterize(wrap_line(text), font)) for text, begin, end in fragments]
+        self.index = IntervalIndex([c.begin for c in self.captions], [c.end for c in self.captions])
+
+        self._frame = background.copy()
+        self._dirty: list[Rect] = []
+
+    def _blend(self, caption: Caption, x: int, y: int) -> Optional[Rect]:
+        h, w = caption.alpha.shape[:2]
+        frame_w, frame_h = self.size
+
+        x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, frame_w), min(y + h, frame_h)
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        region = self._frame[y0:y1, x0:x1]
+        alpha = caption.alpha[y0 - y:y1 - y, x0 - x:x1 - x]
+        color = caption.color[y0 - y:y1 - y, x0 - x:x1 - x]
+        region[...] = region * (1 - alpha) + color + 0.5
+
+        return y0, y1, x0, x1
+
+    def render(self, t: float) -> np.ndarray:
+        """
+        Return the frame at time `t`. The returned array is overwritten by the next call.
+        """
+
+        for y0, y1, x0, x1 in self._dirty:
+            self._frame[y0:y1, x0:x1] = self.background[y0:y1, x0:x1]
+        self._dirty = []
+
+        # later lines are drawn over earlier ones
+        for i in self.index.active(t):
+            caption = self.captions[i]
+            rect = self._blend(caption, *caption_position(t - caption.begin, self.size))
+            if rect is not None:
+                self._dirty.append(rect)
+
+        return self._frame
+
+
+def load_background(image_path: str) -> np.ndarray:
+    with Image.open(image_path) as image:
+        return np.asarray(image.convert("RGB")).copy()
+
+
+def _render_range(
+    image_path: str,
+    fragments: list[tuple[str, float, float]],
+    fps: int,
+    first_frame: int,
+    end_frame: int,
+    output_path: str,
+    codec: str,
+) -> None:
+    """
+    Render frames `first_frame` up to `end_frame` to a video file without audio.
+    """
+
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+    t0, t1 = first_frame / fps, end_frame / fps
+    # only the lines visible in this range are rasterized
+    renderer = CaptionRenderer(
+        load_background(image_path), [f for f in fragments if f[1] < t1 and f[2] > t0]
+    )
+
+    writer = FFMPEG_VideoWriter(output_path, renderer.size, fps, codec=codec)
+    try:
+        for frame in range(first_frame, end_frame):
+            writer.write_frame(renderer.render(frame / fps))
+    finally:
+        writer.close()
+
+
+def audio_duration(audio_path: str) -> float:
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    return ffmpeg_parse_infos(audio_path)["duration"]
+
+
+def render_video(
+    image_path: str,
+    transcript_path: str,
+    audio_path: str,
+    output_path: str,
+    fps: int = FPS,
+    workers: Optional[int] = None,
+    codec: str = "libx264",
+) -> None:
+    """
+    Render a lyric video of the lines in the transcript at `transcript_path` over the image
+    at `image_path`, with the audio at `audio_path`.
+
+    The video is split in `workers` (by default, one per CPU) consecutive ranges of frames
+    that are rendered in parallel processes, then joined and muxed with the audio without
+    re-encoding the video.
+    """
+
+    from moviepy.config import get_setting
+
+    fragments = read_fragments(transcript_path)
+    num_frames = math.ceil(audio_duration(audio_path) * fps)
+    workers = max(1, min(workers or os.cpu_count() or 1, num_frames))
+    bounds = [num_frames * i // workers for i in range(workers + 1)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        parts = [os.path.join(tmp_dir, f"{i:03d}.mp4") for i in range(workers)]
+
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(_render_range, image_path, fragments, fps, first, end, part, codec)
+                for first, end, part in zip(bounds[:-1], bounds[1:], parts)
+            ]
+            for future in futures:
+                future.result()
+
+        concat_list = os.path.join(tmp_dir, "parts.txt")
+        with open(concat_list, "w") as fl:
+            fl.writelines(f"file '{part}'\n" for part in parts)
+
+        # mp3 audio can go into an mp4 file as is
+        audio_codec = "copy" if audio_path.lower().endswith(".mp3") else "aac"
+        subprocess.run(
+            [
+                get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", concat_list,
+                "-i", audio_path,
+                "-map", "0:v", "-map", "1:a",
+                "-c:v", "copy", "-c:a", audio_codec,
+                output_path,
+            ],
+            check=True,
+        )
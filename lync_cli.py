@@ -1,65 +1,54 @@
-import os
+import argparse
 import sys
-import urllib
-# external deps
-from spleeter.separator import Separator
-from aeneas.tools.execute_task import ExecuteTaskCLI
 # lync
-from lync.external.genius import Genius
-from lync.external.soundcloud import Soundcloud
+from lync.pipeline import Pipeline, ArtifactStore, export_song, ARTIFACT_DIR, NETWORK_WORKERS, SEPARATE_WORKERS, ALIGN_WORKERS, QUEUE_SIZE
 
 
-SONG_TARGET = sys.argv[1] #"Lil Keed - Snake"
-OUTDIR = sys.argv[2] #"./cli-test/"
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Fetch lyrics, cover art and audio for songs, extract their vocals and align the lyrics to them."
+    )
+    parser.add_argument("songs", nargs="*", help='song queries, e.g. "Lil Keed - Snake"')
+    parser.add_argument("outdir", help="directory to write the results of every song to")
+    parser.add_argument("--batch", metavar="FILE", help="file with one song query per line")
+    parser.add_argument("--store", default=ARTIFACT_DIR, help="directory of the stage outputs of earlier runs")
+    parser.add_argument("--network-workers", type=int, default=NETWORK_WORKERS)
+    parser.add_argument("--separate-workers", type=int, default=SEPARATE_WORKERS)
+    parser.add_argument("--align-workers", type=int, default=ALIGN_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--precision", default="float32")
+    parser.add_argument("--band-width", type=int, default=None)
+    args = parser.parse_args()
 
-CACHE_FOREVER = -1
-g = Genius(CACHE_FOREVER)
-genius_result = g.search(SONG_TARGET)
-assert genius_result is not None
-# download lyrics
-lyric_path = OUTDIR+SONG_TARGET+".txt"
-with open(OUTDIR+SONG_TARGET+".txt", "w") as f:
-    for line in g.get_lyrics(genius_result).lines:
-        print(line.text, file=f)
-# download cover art
-url=genius_result.song_image_url
-img_type = "."+url.split('.')[-1]
-req = urllib.request.Request(
-    url,
-    data = None,
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
-    }
-)
-raw_img = urllib.request.urlopen(req).read()
-img_path = OUTDIR+SONG_TARGET+img_type
-with open(img_path, 'wb') as f:
-    f.write(raw_img)
-print(f"Found lyrics and cover art for {genius_result.title} by {genius_result.artist_name}\n")
+    songs = list(args.songs)
+    if args.batch:
+        with open(args.batch, "r") as f:
+            songs += [line.strip() for line in f if line.strip()]
+    if not songs:
+        parser.error("no songs given")
 
-print("Downloading song")
-soundcloud = Soundcloud()
-soundcloud_result = soundcloud.search(SONG_TARGET)
-assert soundcloud_result is not None
+    aligner_options = {"precision": args.precision}
+    if args.band_width is not None:
+        aligner_options["band_width"] = args.band_width
 
-transcoding = soundcloud_result.get_transcoding("audio/mpeg")
-assert transcoding is not None
-audio_path = OUTDIR+SONG_TARGET+".mp3"
-soundcloud.download_audio(transcoding, audio_path)
+    pipeline = Pipeline(
+        ArtifactStore(args.store),
+        network_workers=args.network_workers,
+        separate_workers=args.separate_workers,
+        align_workers=args.align_workers,
+        queue_size=args.queue_size,
+        aligner_options=aligner_options,
+    )
 
-print("Extracting vocals")
-separator = Separator('spleeter:2stems')
-separator.separate_to_file(audio_path, OUTDIR)
+    for song in pipeline.run(songs):
+        export_song(song, args.outdir)
+        print(f"Finished {song.title} by {song.artist_name}")
 
-print("Performing Forced Alignment to generate transcript")
-test_audio_path = os.path.realpath(OUTDIR+SONG_TARGET+"/vocals.wav")
-test_transcript_path = os.path.realpath(lyric_path)
-# TODO: migrate to CTC transformers for forced alignment instead of aeneas DTW
-ExecuteTaskCLI(use_sys=False).run(arguments=[
-    None, # dummy program name argument
-    test_audio_path,
-    test_transcript_path,
-    u"task_language=eng|is_text_type=plain|os_task_file_format=json",
-    os.path.realpath(OUTDIR+SONG_TARGET+"-transcript.json")
-    ])
-print("Processing complete")
+    print(f"Processing complete; {len(songs) - len(pipeline.failures)}/{len(songs)} songs aligned")
+    if pipeline.failures:
+        sys.exit(1)
+
+
+# the pipeline's worker processes are spawned and import this module
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Tests of `Aligner.align_many` against repeated `Aligner.align`, with a stub acoustic model.
+"""
+
+import os
+import tempfile
+import unittest
+import torch
+import torchaudio
+from benchmarks.stubs import StubModel
+from benchmarks.synthetic import SAMPLE_RATE, random_transcript
+from lync.aligner import AlignmentJob, Aligner, plan_windows
+from lync.emission_cache import EmissionCache
+from lync.profiling import Profiler
+
+# of different lengths, not in order, and short enough for a single window or spanning many
+DURATIONS_S = [11.3, 1.4, 4.7]
+WINDOW_S = 2.0
+
+
+class AlignManyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.directory = directory.name
+        cls.jobs = [cls.write_song(index, duration_s) for index, duration_s in enumerate(DURATIONS_S)]
+
+        aligner = cls.aligner()
+        cls.expected = [aligner.align(job.vocal_path, job.lyrics_path, job.outfile_path) for job in cls.jobs]
+
+    @classmethod
+    def write_song(cls, index: int, duration_s: float) -> AlignmentJob:
+        generator = torch.Generator().manual_seed(index)
+        waveform = torch.randn(1, int(duration_s * SAMPLE_RATE), generator=generator) * 0.1
+
+        vocal_path = os.path.join(cls.directory, f"{index}.wav")
+        lyrics_path = os.path.join(cls.directory, f"{index}.txt")
+        torchaudio.save(vocal_path, waveform, SAMPLE_RATE)
+        with open(lyrics_path, "w") as fl:
+            fl.write(random_transcript(int(duration_s * 10), seed=index))
+
+        return AlignmentJob(vocal_path, lyrics_path, os.path.join(cls.directory, f"{index}.json"))
+
+    @staticmethod
+    def aligner(**options) -> Aligner:
+        aligner = Aligner(window_s=WINDOW_S, overlap_s=0.5, **options)
+        # the stub stands in for the bundle's model, which would be downloaded on first use
+        aligner._model = StubModel(len(aligner.labels))
+        return aligner
+
+    def assertSameLines(self, found, expected) -> None:
+        self.assertEqual(len(found), len(expected))
+        for lines, other in zip(found, expected):
+            self.assertEqual([line.phrase for line in lines], [line.phrase for line in other])
+            for line, other_line in zip(lines, other):
+                self.assertAlmostEqual(line.start_time_s, other_line.start_time_s)
+                self.assertAlmostEqual(line.end_time_s, other_line.end_time_s)
+
+    def test_align_many(self) -> None:
+        for workers in [0, 1]:
+            with self.subTest(workers=workers), self.aligner(batch_size=4, workers=workers) as aligner:
+                self.assertSameLines(aligner.align_many(self.jobs), self.expected)
+
+    def test_cache_hit(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = EmissionCache(directory.name)
+
+        profiler = Profiler()
+        with profiler.active(trace_memory=False):
+            self.assertSameLines(self.aligner(batch_size=4, cache=cache).align_many(self.jobs), self.expected)
+        plans = [plan_windows(int(duration_s * SAMPLE_RATE), SAMPLE_RATE, WINDOW_S, 0.5) for duration_s in DURATIONS_S]
+        self.assertEqual([len(plan.starts) for plan in plans], [8, 1, 3])
+        self.assertEqual(profiler.counters["aligner.windows"], 8 + 1 + 3)
+
+        # every emission is cached, so the model is neither loaded nor run
+        aligner = Aligner(window_s=WINDOW_S, overlap_s=0.5, batch_size=4, cache=cache)
+        profiler = Profiler()
+        with profiler.active(trace_memory=False):
+            self.assertSameLines(aligner.align_many(self.jobs), self.expected)
+
+        self.assertNotIn("aligner.windows", profiler.counters)
+        self.assertIsNone(aligner._model)
+        self.assertEqual(cache.stats.hits, len(self.jobs))
+
+
+if __name__ == "__main__":
+    unittest.main()
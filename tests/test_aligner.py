@@ -0,0 +1,240 @@
+"""
+Tests of the banded and hierarchical alignments, and of the array-backed merges against the
+list-based originals.
+"""
+
+import os
+import random
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+from benchmarks.synthetic import LABELS, SAMPLE_RATE, ReferenceSong, peaky_emission
+from lync import hierarchical
+from lync.aligner import (
+    EMISSION_STRIDE,
+    PathArrays,
+    _init_worker,
+    backtrack,
+    clean_transcript,
+    get_path,
+    get_trellis,
+    merge_lines,
+    merge_emission_lines,
+    merge_lines_arrays,
+    merge_repeats,
+    merge_repeats_arrays,
+    merge_words,
+    merge_words_arrays,
+)
+from lync.hierarchical import hierarchical_path, line_break_tokens
+from lync.profiling import Profiler
+
+# reference alignments checked in at the root of the repository
+REFERENCES = [
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), name)
+    for name in ["wav2vec2_alignment_anaconda.json", "ctc_seg_alignment_anaconda.json", "ctc_seg_alignment_aatw.json"]
+]
+
+
+def random_song(seed: int, tail: int) -> tuple:
+    """
+    Return the emission and tokens of a song of random tokens spoken every 2 to 10 frames,
+    followed by `tail` silent frames.
+    """
+
+    rng = random.Random(seed)
+    tokens = [rng.randint(1, len(LABELS) - 1) for _ in range(rng.randint(100, 300))]
+    frames, frame = [], rng.randint(0, 40)
+    for _ in tokens:
+        frames.append(frame)
+        frame += rng.randint(2, 10)
+
+    return peaky_emission(list(zip(tokens, frames)), frame + tail, seed=seed), tokens
+
+
+class BandedPathTest(unittest.TestCase):
+    def assertSamePath(self, path, baseline) -> None:
+        self.assertEqual(path.token_index.tolist(), [point.token_index for point in baseline])
+        self.assertEqual(path.time_index.tolist(), [point.time_index for point in baseline])
+
+    def test_silent_tail(self) -> None:
+        # the lyrics end long before the audio, so the path ends far below the last frame
+        for seed in range(5, 9):
+            emission, tokens = random_song(seed, 1500)
+            baseline = backtrack(get_trellis(emission, tokens), emission, tokens)
+
+            for band_width, coarse_factor in [(None, None), (32, None), (64, 4), (256, 4)]:
+                with self.subTest(seed=seed, band_width=band_width, coarse_factor=coarse_factor):
+                    self.assertSamePath(get_path(emission, tokens, band_width, coarse_factor), baseline)
+
+    def test_coarse_band_holds(self) -> None:
+        emission, tokens = random_song(1, 1500)
+        profiler = Profiler()
+
+        with profiler.active(trace_memory=False):
+            path = get_path(emission, tokens, 64, 4)
+
+        self.assertNotIn("aligner.band_fallbacks", profiler.counters)
+        self.assertSamePath(path, backtrack(get_trellis(emission, tokens), emission, tokens))
+
+    def test_narrow_bands(self) -> None:
+        # bands too narrow to hold the path must fall back rather than return another one
+        for seed in range(9, 15):
+            emission, tokens = random_song(seed, random.Random(seed).randint(0, 1000))
+            baseline = backtrack(get_trellis(emission, tokens), emission, tokens)
+
+            for band_width, coarse_factor in [(16, None), (32, None), (16, 4), (32, 4)]:
+                with self.subTest(seed=seed, band_width=band_width, coarse_factor=coarse_factor):
+                    self.assertSamePath(get_path(emission, tokens, band_width, coarse_factor), baseline)
+
+
+class MergeArraysTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.songs = [ReferenceSong(reference) for reference in REFERENCES]
+        cls.paths = [get_path(song.emission, song.tokens, 256, 4) for song in cls.songs]
+
+    def assertSameSegments(self, segments, expected) -> None:
+        self.assertEqual(len(segments), len(expected))
+        for segment, other in zip(segments, expected):
+            self.assertEqual((segment.label, segment.start, segment.end), (other.label, other.start, other.end))
+            self.assertAlmostEqual(segment.score, other.score, places=5)
+
+    def test_merge_repeats(self) -> None:
+        for reference, song, path in zip(REFERENCES, self.songs, self.paths):
+            transcript = clean_transcript(song.transcript)
+            with self.subTest(reference=reference):
+                self.assertSameSegments(
+                    merge_repeats_arrays(path).to_segments(transcript),
+                    merge_repeats(path.to_points(), transcript),
+                )
+
+    def test_merge_words(self) -> None:
+        for reference, song, path in zip(REFERENCES, self.songs, self.paths):
+            transcript = clean_transcript(song.transcript)
+            with self.subTest(reference=reference):
+                self.assertSameSegments(
+                    merge_words_arrays(merge_repeats_arrays(path), transcript).to_segments(transcript),
+                    merge_words(merge_repeats(path.to_points(), transcript)),
+                )
+
+    def test_merge_lines(self) -> None:
+        for reference, song, path in zip(REFERENCES, self.songs, self.paths):
+            transcript = clean_transcript(song.transcript)
+            lines = song.transcript.split("\n")
+            waveform_len = song.num_frames * EMISSION_STRIDE
+
+            words = merge_words_arrays(merge_repeats_arrays(path), transcript)
+            expected = merge_words(merge_repeats(path.to_points(), transcript))
+            expected = merge_lines(expected, lines, waveform_len, SAMPLE_RATE)
+            found = merge_lines_arrays(words, lines, waveform_len, SAMPLE_RATE)
+            with self.subTest(reference=reference):
+                self.assertEqual(len(found), len(expected))
+                for line, other in zip(found, expected):
+                    self.assertEqual(line.phrase, other.phrase)
+                    self.assertAlmostEqual(line.start_time_s, other.start_time_s)
+                    self.assertAlmostEqual(line.end_time_s, other.end_time_s)
+
+    def test_emission_seconds(self) -> None:
+        # frames are converted at the model's stride, however much silence follows the lyrics
+        for reference, song, path in zip(REFERENCES, self.songs, self.paths):
+            transcript = clean_transcript(song.transcript)
+            words = merge_words_arrays(merge_repeats_arrays(path), transcript)
+            lines = merge_emission_lines(words, song.lines, SAMPLE_RATE)
+            with self.subTest(reference=reference):
+                self.assertAlmostEqual(lines[0].start_time_s, words.start[0].item() * EMISSION_STRIDE / SAMPLE_RATE)
+                self.assertAlmostEqual(lines[-1].end_time_s, words.end[-1].item() * EMISSION_STRIDE / SAMPLE_RATE)
+
+    def test_get_path_baseline(self) -> None:
+        # the full trellis of the baseline is slow, so only the shortest song is compared
+        song = self.songs[-1]
+        baseline = backtrack(get_trellis(song.emission, song.tokens), song.emission, song.tokens)
+
+        for band_width, coarse_factor in [(None, None), (256, 4)]:
+            path = get_path(song.emission, song.tokens, band_width, coarse_factor)
+            with self.subTest(band_width=band_width, coarse_factor=coarse_factor):
+                self.assertEqual(path.token_index.tolist(), [point.token_index for point in baseline])
+                self.assertEqual(path.time_index.tolist(), [point.time_index for point in baseline])
+                for score, point in zip(path.score.tolist(), baseline):
+                    self.assertAlmostEqual(score, point.score, places=5)
+
+
+def word_frames(song: ReferenceSong, path: PathArrays) -> list[tuple[int, int]]:
+    words = merge_words_arrays(merge_repeats_arrays(path), clean_transcript(song.transcript))
+    return list(zip(words.start.tolist(), words.end.tolist()))
+
+
+class HierarchicalPathTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.songs = [ReferenceSong(reference) for reference in REFERENCES]
+        cls.expected = [word_frames(song, get_path(song.emission, song.tokens, 256, 4)) for song in cls.songs]
+
+    @staticmethod
+    def anchors(song: ReferenceSong) -> list[tuple[int, int]]:
+        return hierarchical.find_anchors(
+            hierarchical.coarse_entries(song.emission, song.tokens, hierarchical.ANCHOR_FACTOR),
+            line_break_tokens(song.transcript),
+            hierarchical.blank_frames(song.emission),
+        )
+
+    def test_reference_songs(self) -> None:
+        executor = ProcessPoolExecutor(2, initializer=_init_worker)
+        self.addCleanup(executor.shutdown)
+
+        for reference, song, expected in zip(REFERENCES, self.songs, self.expected):
+            for parts_executor, coarse_factor in [(None, 4), (None, None), (executor, 4)]:
+                with self.subTest(reference=reference, executor=parts_executor is not None, coarse_factor=coarse_factor):
+                    path = hierarchical_path(song.emission, song.tokens, song.transcript, parts_executor, 256, coarse_factor)
+                    self.assertEqual(word_frames(song, path), expected)
+
+        # the songs are split at all
+        self.assertGreater(len(self.anchors(self.songs[0])), 0)
+
+    def test_dropped_splits(self) -> None:
+        # The lines of this song follow each other without a pause, so splits forced onto
+        # the pause after the first character of the next line put that character on the
+        # wrong side, and are dropped.
+        song, expected = self.songs[2], self.expected[2]
+        path = get_path(song.emission, song.tokens, 256, 4)
+        starts = [path.time_index[path.token_index == token][0].item() for token in range(len(song.tokens))]
+        anchors = [
+            (token, (starts[token + 1] + starts[token + 2]) // 2)
+            for token in line_break_tokens(song.transcript)[3::6]
+            if starts[token + 2] - starts[token + 1] >= hierarchical.MIN_GAP_FRAMES
+        ]
+
+        solve_span = mock.patch.object(hierarchical, "solve_span", wraps=hierarchical.solve_span)
+        with mock.patch.object(hierarchical, "find_anchors", return_value=anchors), solve_span as solved:
+            found = hierarchical_path(song.emission, song.tokens, song.transcript, None, 256, 4)
+
+        self.assertGreater(len(anchors), 1)
+        self.assertEqual(word_frames(song, found), expected)
+        # the parts were joined back into the whole song
+        self.assertEqual(len(solved.call_args.args[1]), len(song.tokens))
+
+    def test_kept_splits(self) -> None:
+        # Splits forced onto the frame after the separator of line breaks without a pause
+        # are dropped, and those at the pauses of the song are kept.
+        song, expected = self.songs[0], self.expected[0]
+        path = get_path(song.emission, song.tokens, 256, 4)
+        anchors = self.anchors(song)
+        paused = {token for token, _ in anchors}
+        forced = [
+            (token, path.time_index[path.token_index == token][0].item() + 1)
+            for token in line_break_tokens(song.transcript)
+            if token not in paused
+        ][1::8]
+
+        solve_span = mock.patch.object(hierarchical, "solve_span", wraps=hierarchical.solve_span)
+        with mock.patch.object(hierarchical, "find_anchors", return_value=sorted(anchors + forced)), solve_span as solved:
+            found = hierarchical_path(song.emission, song.tokens, song.transcript, None, 256, 4)
+
+        self.assertGreater(len(forced), 0)
+        self.assertEqual(word_frames(song, found), expected)
+        # the parts were not all joined back into the whole song
+        self.assertLess(len(solved.call_args.args[1]), len(song.tokens))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+"""
+Tests of `lync.external.async_api` against a local aiohttp server.
+"""
+
+import asyncio
+import json
+import time
+import unittest
+from typing import Mapping
+from unittest import mock
+import aiohttp
+from aiohttp import web
+from lync.external import async_api
+from lync.external.api import APIResponse, APIErrorCode
+from lync.external.async_api import AsyncAPIInterface, TokenBucket
+
+
+class JSONInterface(AsyncAPIInterface):
+    def _build_response(self, status: int, headers: Mapping[str, str], body: bytes) -> APIResponse:
+        return APIResponse.Success(json.loads(body))
+
+
+class StubServer:
+    """
+    Server answering each path with the statuses in `responses[path]` in turn, then with
+    200, recording the times requests arrive at.
+    """
+
+    def __init__(self, responses: dict[str, list[tuple[int, dict[str, str]]]]) -> None:
+        self.responses = {path: list(statuses) for path, statuses in responses.items()}
+        self.arrivals: dict[str, list[float]] = {path: [] for path in responses}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.arrivals[request.path].append(time.monotonic())
+        statuses = self.responses[request.path]
+
+        if statuses:
+            status, headers = statuses.pop(0)
+            return web.Response(status=status, headers=headers, text="{}")
+
+        return web.json_response({"path": request.path})
+
+
+class AsyncAPIInterfaceTest(unittest.IsolatedAsyncioTestCase):
+    async def start(self, server: StubServer, rate: float = 100.0) -> JSONInterface:
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", server.handle)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self.addAsyncCleanup(runner.cleanup)
+
+        port = runner.addresses[0][1]
+        session = aiohttp.ClientSession()
+        self.addAsyncCleanup(session.close)
+
+        return JSONInterface(f"http://127.0.0.1:{port}", session, rate=rate)
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(async_api, "BACKOFF_SECONDS", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_retries_server_errors(self) -> None:
+        server = StubServer({"/flaky": [(503, {}), (500, {})]})
+        api = await self.start(server)
+
+        response = await api.get("/flaky")
+
+        self.assertTrue(response.ok())
+        self.assertEqual(response.get_data(), {"path": "/flaky"})
+        self.assertEqual(len(server.arrivals["/flaky"]), 3)
+
+    async def test_gives_up_after_retries(self) -> None:
+        server = StubServer({"/down": [(503, {})] * 10})
+        api = await self.start(server)
+
+        response = await api.get("/down")
+
+        self.assertFalse(response.ok())
+        self.assertEqual(response.get_error().code, APIErrorCode.Unknown)
+        self.assertEqual(len(server.arrivals["/down"]), async_api.DEFAULT_RETRIES + 1)
+
+    async def test_waits_for_retry_after(self) -> None:
+        server = StubServer({"/limited": [(429, {"Retry-After": "0.5"})]})
+        api = await self.start(server)
+
+        response = await api.get("/limited")
+
+        self.assertTrue(response.ok())
+        first, second = server.arrivals["/limited"]
+        self.assertGreaterEqual(second - first, 0.5)
+
+    async def test_burst_of_rate_limits_halves_rate_once(self) -> None:
+        # every request of the first burst is rate limited
+        server = StubServer({"/burst": [(429, {"Retry-After": "0.2"})] * 8})
+        api = await self.start(server, rate=8.0)
+
+        responses = await asyncio.gather(*(api.get("/burst") for _ in range(8)))
+
+        self.assertTrue(all(response.ok() for response in responses))
+        _, bucket = api._host_limits(api.get_api_root())
+        self.assertGreaterEqual(bucket.rate, 4.0)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_coalesces_penalties(self) -> None:
+        with mock.patch.object(async_api.time, "monotonic", return_value=100.0):
+            bucket = TokenBucket(8.0)
+            bucket.penalize(None, started_at=99.5)
+            # in flight when the first penalty came in
+            bucket.penalize(None, started_at=99.6)
+
+        self.assertEqual(bucket.rate, 4.0)
+
+        # sent after the penalty, but rejected within its round trip time
+        with mock.patch.object(async_api.time, "monotonic", return_value=100.2):
+            bucket.penalize(None, started_at=100.1)
+
+        self.assertEqual(bucket.rate, 4.0)
+
+        with mock.patch.object(async_api.time, "monotonic", return_value=102.0):
+            bucket.penalize(None, started_at=101.0)
+
+        self.assertEqual(bucket.rate, 2.0)
+
+    def test_recovers_linearly(self) -> None:
+        with mock.patch.object(async_api.time, "monotonic", return_value=100.0):
+            bucket = TokenBucket(8.0, recovery_s=10.0)
+            bucket.penalize(1.0)
+
+        with mock.patch.object(async_api.time, "monotonic", return_value=106.0):
+            bucket.reward()
+
+        # paused for the first second, then 0.8 per second for 5 seconds
+        self.assertAlmostEqual(bucket.rate, 8.0)
+
+        with mock.patch.object(async_api.time, "monotonic", return_value=107.0):
+            bucket.penalize(None, started_at=106.5)
+        with mock.patch.object(async_api.time, "monotonic", return_value=109.0):
+            bucket.reward()
+
+        self.assertAlmostEqual(bucket.rate, 5.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Tests of the on-disk emission cache.
+"""
+
+import io
+import os
+import tempfile
+import time
+import unittest
+import torch
+from lync.emission_cache import STALE_TMP_SECONDS, EmissionCache, hash_audio
+
+
+def emission(seed: int, num_frames: int = 10) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.log_softmax(torch.randn(num_frames, 29, generator=generator), dim=-1)
+
+
+class EmissionCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = EmissionCache(self.directory)
+
+    def set_last_use(self, key: str, seconds_ago: float) -> None:
+        at = time.time() - seconds_ago
+        os.utime(os.path.join(self.directory, key + ".npy"), (at, at))
+
+    def test_round_trip(self) -> None:
+        key = EmissionCache.key("audio", bundle="WAV2VEC2_ASR_BASE_960H", window_s=20.0)
+        self.cache.put(key, emission(0))
+        found = self.cache.get(key)
+
+        self.assertIsNotNone(found)
+        self.assertEqual(found.dtype, torch.float32)
+        self.assertTrue(torch.equal(found, emission(0)))
+
+        # writing to the tensor leaves the entry untouched
+        found += 1
+        self.assertTrue(torch.equal(self.cache.get(key), emission(0)))
+
+    def test_overwrite(self) -> None:
+        self.cache.put("key", emission(0))
+        self.cache.put("key", emission(1))
+
+        self.assertTrue(torch.equal(self.cache.get("key"), emission(1)))
+
+    def test_keys(self) -> None:
+        key = EmissionCache.key("audio", bundle="b", window_s=20.0)
+
+        self.assertEqual(key, EmissionCache.key("audio", window_s=20.0, bundle="b"))
+        self.assertNotEqual(key, EmissionCache.key("audio", bundle="b", window_s=10.0))
+        self.assertNotEqual(key, EmissionCache.key("other", bundle="b", window_s=20.0))
+
+    def test_hash_audio(self) -> None:
+        path = os.path.join(self.directory, "audio.wav")
+        with open(path, "wb") as fl:
+            fl.write(b"RIFF" + bytes(range(256)) * 10)
+
+        with open(path, "rb") as fl:
+            buffer = io.BytesIO(fl.read())
+
+        self.assertEqual(hash_audio(path), hash_audio(buffer, chunk_size=7))
+        # the file object is rewound for the next reader
+        self.assertEqual(buffer.tell(), 0)
+
+    def test_lru_eviction(self) -> None:
+        self.cache.put("first", emission(0))
+        entry_bytes = os.path.getsize(os.path.join(self.directory, "first.npy"))
+        self.cache.max_bytes = 2 * entry_bytes
+
+        self.cache.put("second", emission(1))
+        self.set_last_use("first", 20)
+        self.set_last_use("second", 10)
+
+        # using the oldest entry makes the other one the least recently used
+        self.assertIsNotNone(self.cache.get("first"))
+        self.cache.put("third", emission(2))
+
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNotNone(self.cache.get("third"))
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+        self.set_last_use("first", 20)
+        self.set_last_use("third", 10)
+        self.cache.put("fourth", emission(3))
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ["fourth.npy", "third.npy"])
+        self.assertEqual(self.cache.stats.evictions, 2)
+
+    def test_stale_tmp_cleanup(self) -> None:
+        stale = os.path.join(self.directory, "stale.tmp")
+        fresh = os.path.join(self.directory, "fresh.tmp")
+        for path in [stale, fresh]:
+            with open(path, "wb") as fl:
+                fl.write(b"partial")
+
+        at = time.time() - STALE_TMP_SECONDS - 10
+        os.utime(stale, (at, at))
+        self.cache.put("key", emission(0))
+
+        # a writer may still be working on the fresh one
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertIsNotNone(self.cache.get("key"))
+
+    def test_stats(self) -> None:
+        self.assertEqual(self.cache.stats.hit_rate, 0.0)
+        self.assertIsNone(self.cache.get("key"))
+
+        self.cache.put("key", emission(0))
+        self.cache.get("key")
+        self.cache.get("key")
+        self.cache.get("other")
+
+        self.assertEqual(self.cache.stats.hits, 2)
+        self.assertEqual(self.cache.stats.misses, 2)
+        self.assertEqual(self.cache.stats.evictions, 0)
+        self.assertEqual(self.cache.stats.hit_rate, 0.5)
+
+    def test_corrupt_entry_is_a_miss(self) -> None:
+        with open(os.path.join(self.directory, "key.npy"), "wb") as fl:
+            fl.write(b"not an array")
+
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(self.cache.stats.misses, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+Tests of the extraction of lyrics from the state embedded in Genius lyrics pages.
+"""
+
+import json
+import unittest
+from lync.external.genius.lyrics import extract_lyrics_data
+
+LYRICS_DATA = {"body": {"children": [{"tag": "root", "children": ["line", {"tag": "br"}]}]}}
+
+
+def lyrics_page(state: dict) -> str:
+    literal = json.dumps(state).replace("\\", "\\\\").replace("'", "\\'").replace('"', '\\"')
+
+    return f"<html><script>window.__PRELOADED_STATE__ = JSON.parse('{literal}');</script></html>"
+
+
+class ExtractLyricsDataTest(unittest.TestCase):
+    def test_extracts_lyrics_data(self) -> None:
+        page = lyrics_page({"songPage": {"lyricsData": LYRICS_DATA}})
+
+        self.assertEqual(extract_lyrics_data(page), LYRICS_DATA)
+
+    def test_skips_other_lyrics_data_keys(self) -> None:
+        page = lyrics_page({
+            "songPage": {
+                "other": {"lyricsData": "decoy"},
+                "related": {"lyricsData": {"id": 1, "padding": "x" * 200_000}},
+                "lyricsData": LYRICS_DATA,
+            }
+        })
+
+        self.assertEqual(extract_lyrics_data(page), LYRICS_DATA)
+
+    def test_missing_lyrics_data(self) -> None:
+        page = lyrics_page({"songPage": {"other": {"lyricsData": "decoy"}}})
+
+        self.assertIsNone(extract_lyrics_data(page))
+
+
+if __name__ == "__main__":
+    unittest.main()
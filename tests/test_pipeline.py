@@ -0,0 +1,212 @@
+"""
+Tests of the artifact store and of pipeline runs resuming from it, with stub stages.
+"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from dataclasses import replace
+from lync.pipeline import DONE_MARKER, STALE_TMP_SECONDS, ArtifactStore, Pipeline, Song
+
+
+class StubPipeline(Pipeline):
+    """
+    Pipeline whose stages write the query to a file instead of doing any work, recording
+    the entries they build and failing on the `(stage, query)` pairs in `fail`.
+    """
+
+    def __init__(self, store: ArtifactStore, fail: frozenset = frozenset()) -> None:
+        super().__init__(store, network_workers=2, report_interval=60.0, report_file=io.StringIO())
+        self.fail = fail
+        self.built: list[tuple[str, str]] = []
+
+    def _stub(self, stage: str, song: Song) -> tuple[str, bool]:
+        def build(output_dir: str) -> dict:
+            with self._lock:
+                self.built.append((stage, song.query))
+            if (stage, song.query) in self.fail:
+                raise RuntimeError(f"{stage} failed")
+
+            with open(os.path.join(output_dir, stage + ".txt"), "w") as fl:
+                fl.write(song.query)
+            return {"file": stage + ".txt"}
+
+        metadata, path, cached = self._cached(stage, self.store.key(stage, query=song.query), build)
+        return os.path.join(path, metadata["file"]), cached
+
+    def _fetch_lyrics(self, song: Song) -> tuple[Song, bool]:
+        path, cached = self._stub("lyrics", song)
+        return replace(song, lyrics_path=path), cached
+
+    def _fetch_audio(self, song: Song) -> tuple[Song, bool]:
+        path, cached = self._stub("audio", song)
+        return replace(song, audio_path=path), cached
+
+    def _separate(self, song: Song) -> tuple[Song, bool]:
+        path, cached = self._stub("vocals", song)
+        return replace(song, vocals_path=path), cached
+
+    def _align(self, song: Song) -> tuple[Song, bool]:
+        path, cached = self._stub("transcript", song)
+        return replace(song, transcript_path=path), cached
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.store = ArtifactStore(self.directory)
+
+    def write(self, name: str, text: str):
+        def build(output_dir: str) -> dict:
+            with open(os.path.join(output_dir, name), "w") as fl:
+                fl.write(text)
+            return {"file": name}
+
+        return build
+
+
+class ArtifactStoreTest(StoreTestCase):
+    def test_put_get(self) -> None:
+        key = ArtifactStore.key("lyrics", query="song")
+        self.assertIsNone(self.store.get("lyrics", key))
+
+        metadata = self.store.put("lyrics", key, self.write("lyrics.txt", "la la"))
+
+        self.assertEqual(metadata, {"file": "lyrics.txt"})
+        self.assertEqual(self.store.get("lyrics", key), metadata)
+        with open(os.path.join(self.store.path("lyrics", key), "lyrics.txt")) as fl:
+            self.assertEqual(fl.read(), "la la")
+        self.assertEqual(os.listdir(os.path.join(self.directory, "lyrics")), [key])
+
+    def test_keys(self) -> None:
+        key = ArtifactStore.key("vocals", audio="digest", model="m")
+
+        self.assertEqual(key, ArtifactStore.key("vocals", model="m", audio="digest"))
+        self.assertNotEqual(key, ArtifactStore.key("vocals", audio="digest", model="other"))
+        self.assertNotEqual(key, ArtifactStore.key("audio", audio="digest", model="m"))
+
+    def test_failed_build(self) -> None:
+        def build(output_dir: str) -> dict:
+            with open(os.path.join(output_dir, "partial.txt"), "w") as fl:
+                fl.write("partial")
+            raise RuntimeError("crashed")
+
+        with self.assertRaises(RuntimeError):
+            self.store.put("lyrics", "key", build)
+
+        self.assertIsNone(self.store.get("lyrics", "key"))
+        self.assertEqual(os.listdir(os.path.join(self.directory, "lyrics")), [])
+
+    def test_concurrent_put(self) -> None:
+        # both builds are running before either entry is renamed into place
+        barrier = threading.Barrier(2, timeout=10)
+        results = {}
+
+        def put(text: str) -> None:
+            def build(output_dir: str) -> dict:
+                self.write("lyrics.txt", text)(output_dir)
+                barrier.wait()
+                return {"text": text}
+
+            results[text] = self.store.put("lyrics", "key", build)
+
+        threads = [threading.Thread(target=put, args=(text,)) for text in ["first", "second"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {"first": {"text": "first"}, "second": {"text": "second"}})
+        # one of the entries won and is whole, and the other one left nothing behind
+        metadata = self.store.get("lyrics", "key")
+        self.assertIn(metadata, results.values())
+        with open(os.path.join(self.store.path("lyrics", "key"), "lyrics.txt")) as fl:
+            self.assertEqual(fl.read(), metadata["text"])
+        self.assertEqual(os.listdir(os.path.join(self.directory, "lyrics")), ["key"])
+
+    def test_missing_marker_is_a_miss(self) -> None:
+        path = self.store.path("lyrics", "key")
+        os.makedirs(path)
+        with open(os.path.join(path, "lyrics.txt"), "w") as fl:
+            fl.write("la la")
+
+        self.assertIsNone(self.store.get("lyrics", "key"))
+
+        with open(os.path.join(path, DONE_MARKER), "w") as fl:
+            fl.write("{not json")
+
+        self.assertIsNone(self.store.get("lyrics", "key"))
+
+        with open(os.path.join(path, DONE_MARKER), "w") as fl:
+            json.dump({"file": "lyrics.txt"}, fl)
+
+        self.assertEqual(self.store.get("lyrics", "key"), {"file": "lyrics.txt"})
+
+    def test_stale_tmp_cleanup(self) -> None:
+        stage_dir = os.path.join(self.directory, "lyrics")
+        stale = os.path.join(stage_dir, ".tmp-stale")
+        fresh = os.path.join(stage_dir, ".tmp-fresh")
+        for path in [stale, fresh]:
+            os.makedirs(path)
+            with open(os.path.join(path, "lyrics.txt"), "w") as fl:
+                fl.write("partial")
+
+        at = time.time() - STALE_TMP_SECONDS - 10
+        os.utime(stale, (at, at))
+        self.store.put("lyrics", "key", self.write("lyrics.txt", "la la"))
+
+        # another run may still be building the fresh one
+        self.assertEqual(sorted(os.listdir(stage_dir)), [".tmp-fresh", "key"])
+
+
+class PipelineRunTest(StoreTestCase):
+    queries = ["first", "second", "third"]
+
+    def run_pipeline(self, fail: frozenset = frozenset()) -> tuple[StubPipeline, list[Song]]:
+        pipeline = StubPipeline(self.store, fail)
+        return pipeline, list(pipeline.run(self.queries))
+
+    def test_run(self) -> None:
+        pipeline, songs = self.run_pipeline()
+
+        self.assertEqual(sorted(song.query for song in songs), self.queries)
+        for song in songs:
+            with open(song.transcript_path) as fl:
+                self.assertEqual(fl.read(), song.query)
+        self.assertEqual(len(pipeline.built), 4 * len(self.queries))
+        self.assertEqual(pipeline.failures, [])
+
+    def test_resume(self) -> None:
+        pipeline, songs = self.run_pipeline(frozenset({("vocals", "second"), ("transcript", "third")}))
+
+        self.assertEqual([song.query for song in songs], ["first"])
+        self.assertEqual(sorted((query, stage) for query, stage, _ in pipeline.failures), [
+            ("second", "separate"),
+            ("third", "align"),
+        ])
+
+        # the next run only builds what is missing, from the first stage that failed on
+        pipeline, songs = self.run_pipeline()
+
+        self.assertEqual(sorted(song.query for song in songs), self.queries)
+        self.assertEqual(sorted(pipeline.built), [
+            ("transcript", "second"),
+            ("transcript", "third"),
+            ("vocals", "second"),
+        ])
+        self.assertEqual(pipeline.failures, [])
+
+        pipeline, songs = self.run_pipeline()
+
+        self.assertEqual(len(songs), len(self.queries))
+        self.assertEqual(pipeline.built, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
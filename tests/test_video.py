@@ -0,0 +1,41 @@
+"""
+Tests of the rasterization of lyric lines.
+"""
+
+import unittest
+from lync.video import WORDS_PER_ROW, load_font, rasterize, wrap_line
+
+
+class RasterizeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.font = load_font()
+
+    def test_single_row(self) -> None:
+        image = rasterize(wrap_line("hello world"), self.font)
+
+        self.assertEqual(image.ndim, 3)
+        self.assertEqual(image.shape[2], 4)
+        self.assertGreater(image[..., 3].max(), 0)
+
+    def test_wrapped_line(self) -> None:
+        # rows of different widths are centered at fractional offsets
+        words = ["word"] * WORDS_PER_ROW + ["a", "longer", "second", "row"]
+        text = wrap_line(" ".join(words))
+        self.assertIn("\n", text)
+
+        image = rasterize(text, self.font)
+        single = rasterize(wrap_line("word"), self.font)
+
+        self.assertEqual(image.shape[2], 4)
+        self.assertGreater(image.shape[0], single.shape[0])
+        self.assertGreater(image[..., 3].max(), 0)
+
+    def test_odd_width_rows(self) -> None:
+        for extra in ["i", "ii", "iii", "wide words"]:
+            image = rasterize(wrap_line(" ".join(["word"] * WORDS_PER_ROW + [extra])), self.font)
+
+            self.assertGreater(image.shape[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Tests of the planning of overlapping audio windows and of stitching their emissions.
+"""
+
+import unittest
+import torch
+from lync.aligner import EMISSION_STRIDE, EmissionStitcher, plan_windows
+
+SAMPLE_RATE = 16000
+
+
+def window_emission(start: int, length: int) -> torch.Tensor:
+    # wav2vec2 emits one frame less than the strides in a window, and each frame here holds
+    # the index of the frame of the whole track it stands for
+    first_frame = start // EMISSION_STRIDE
+    return torch.arange(first_frame, first_frame + length // EMISSION_STRIDE - 1).unsqueeze(1)
+
+
+def stitch(plan) -> torch.Tensor:
+    stitcher = EmissionStitcher(plan)
+    return torch.cat([stitcher.add(index, window_emission(start, plan.length)) for index, start in enumerate(plan.starts)])
+
+
+class PlanWindowsTest(unittest.TestCase):
+    def test_short_track(self) -> None:
+        for num_samples in [EMISSION_STRIDE * 10, SAMPLE_RATE * 20]:
+            with self.subTest(num_samples=num_samples):
+                plan = plan_windows(num_samples, SAMPLE_RATE, 20.0, 1.0)
+                self.assertEqual(plan.starts, [0])
+                self.assertEqual(plan.length, num_samples)
+                self.assertEqual(plan.discard, 0)
+
+    def test_last_window_moved_back(self) -> None:
+        num_samples = SAMPLE_RATE * 45 + 123
+        plan = plan_windows(num_samples, SAMPLE_RATE, 20.0, 1.0)
+
+        self.assertEqual(plan.length, SAMPLE_RATE * 20)
+        self.assertEqual(plan.starts[:2], [0, SAMPLE_RATE * 19])
+        # the last window ends with the track, short of at most one stride
+        self.assertLessEqual(plan.starts[-1] + plan.length, num_samples)
+        self.assertGreater(plan.starts[-1] + plan.length, num_samples - EMISSION_STRIDE)
+        self.assertLess(plan.starts[-2], plan.starts[-1])
+        for start in plan.starts:
+            self.assertEqual(start % EMISSION_STRIDE, 0)
+
+    def test_tiny_overlap(self) -> None:
+        # consecutive windows overlap by at least two frames, whatever is asked for
+        plan = plan_windows(SAMPLE_RATE * 60, SAMPLE_RATE, 5.0, 0.0)
+        hop = plan.starts[1] - plan.starts[0]
+
+        self.assertEqual(plan.length - hop, 2 * EMISSION_STRIDE)
+        self.assertEqual(plan.discard, 1)
+
+
+class EmissionStitcherTest(unittest.TestCase):
+    def test_frames(self) -> None:
+        # every frame of the track appears once, in order, at its own index
+        for seconds in [3.0, 20.0, 20.5, 39.0, 61.3, 300.0]:
+            for window_s, overlap_s in [(20.0, 1.0), (5.0, 0.0), (7.3, 2.9), (2.0, 1.9)]:
+                num_samples = int(seconds * SAMPLE_RATE)
+                plan = plan_windows(num_samples, SAMPLE_RATE, window_s, overlap_s)
+                with self.subTest(seconds=seconds, window_s=window_s, overlap_s=overlap_s):
+                    frames = stitch(plan).squeeze(1)
+                    num_frames = (plan.starts[-1] + plan.length) // EMISSION_STRIDE - 1
+                    self.assertTrue(torch.equal(frames, torch.arange(num_frames)))
+
+    def test_frame_count(self) -> None:
+        # the stitched emission is as long as the emission of the whole track at once
+        num_samples = SAMPLE_RATE * 50
+        plan = plan_windows(num_samples, SAMPLE_RATE, 20.0, 1.0)
+
+        self.assertEqual(stitch(plan).size(0), len(window_emission(0, num_samples)))
+
+
+if __name__ == "__main__":
+    unittest.main()